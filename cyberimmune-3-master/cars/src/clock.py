@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+
+# Режим часов симуляции: real - реальное время, virtual - ускоренное виртуальное,
+# manual - виртуальное время идёт только по запросу /clock/advance
+CLOCK_MODE = os.getenv('CLOCK_MODE', 'real')
+# Во сколько раз виртуальное время идёт быстрее реального (для режима virtual)
+CLOCK_SPEEDUP = float(os.getenv('CLOCK_SPEEDUP', 10))
+
+
+class RealClock:
+    mode = 'real'
+    manual = False
+
+    def time(self):
+        return time.time()
+
+    # Сколько реальных секунд ждать между тактами
+    def real_interval(self, interval):
+        return interval
+
+    def advance(self, seconds):
+        pass
+
+    def to_dict(self):
+        return {'mode': self.mode, 'time': self.time()}
+
+
+# Виртуальные часы: время сдвигается только тактами симуляции,
+# поэтому время поездки и её движение всегда согласованы между собой
+class VirtualClock:
+    def __init__(self, speedup=CLOCK_SPEEDUP, manual=False, start=None):
+        self.speedup = speedup
+        self.manual = manual
+        self.mode = 'manual' if manual else 'virtual'
+        self._now = time.time() if start is None else start
+        self._lock = threading.Lock()
+
+    def time(self):
+        with self._lock:
+            return self._now
+
+    def real_interval(self, interval):
+        return interval / self.speedup
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += seconds
+
+    def to_dict(self):
+        return {'mode': self.mode, 'time': self.time(), 'speedup': None if self.manual else self.speedup}
+
+
+def make_clock(mode=CLOCK_MODE, speedup=CLOCK_SPEEDUP):
+    if mode == 'real':
+        return RealClock()
+    if mode == 'virtual':
+        if speedup <= 0:
+            raise ValueError("CLOCK_SPEEDUP должен быть больше нуля")
+        return VirtualClock(speedup)
+    if mode == 'manual':
+        return VirtualClock(manual=True)
+    raise ValueError(f"Неизвестный режим часов: {mode}")
@@ -0,0 +1,134 @@
+import threading
+
+import numpy as np
+
+from .spatial import GridIndex
+
+
+# Поле автомобиля, которое хранится в строке массива состояния автопарка
+class FleetField:
+    def __init__(self, array, cast):
+        self.array = array
+        self.cast = cast
+
+    def __get__(self, car, owner=None):
+        if car is None:
+            return self
+        return self.cast(getattr(car.fleet, self.array)[car.row])
+
+    def __set__(self, car, value):
+        getattr(car.fleet, self.array)[car.row] = value
+
+
+# Состояние всего автопарка в массивах NumPy: одна строка на автомобиль.
+# Один такт симуляции обновляет все едущие автомобили несколькими операциями над массивами.
+class FleetState:
+    def __init__(self, max_speed, geofence, capacity=1024, seed=None):
+        self.max_speed = max_speed
+        self.geofence = geofence
+        self.size = 0
+        self.owners = []
+        self.speed = np.zeros(capacity)
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.is_running = np.zeros(capacity, dtype=bool)
+        self.speed_violations = np.zeros(capacity, dtype=np.int64)
+        self.zone_violations = np.zeros(capacity, dtype=np.int64)
+        self.in_zone = np.ones(capacity, dtype=bool)
+        # Версия состояния автопарка и версия последнего изменения каждой строки
+        self.version = 0
+        self.row_version = np.zeros(capacity, dtype=np.int64)
+        self.rng = np.random.default_rng(seed)
+        self.index = GridIndex(capacity=capacity)
+        self.lock = threading.Lock()
+
+    def allocate(self, owner):
+        with self.lock:
+            if self.size == len(self.speed):
+                self._grow(2 * len(self.speed))
+            row = self.size
+            self.size += 1
+            self.owners.append(owner)
+            self.index.insert(row, self.x[row], self.y[row])
+            return row
+
+    def _grow(self, capacity):
+        for name in ('speed', 'x', 'y', 'is_running', 'speed_violations', 'zone_violations', 'in_zone',
+                     'row_version'):
+            old = getattr(self, name)
+            new = np.ones(capacity, dtype=old.dtype) if name == 'in_zone' else np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def touch(self, row):
+        with self.lock:
+            self.version += 1
+            self.row_version[row] = self.version
+
+    def move(self, row, x, y):
+        with self.lock:
+            self.x[row] = x
+            self.y[row] = y
+            self.index.move(row, x, y)
+            self.version += 1
+            self.row_version[row] = self.version
+
+    # Строки, изменившиеся после указанной версии
+    def changed_since(self, version, rows=None):
+        if rows is None:
+            rows = np.arange(self.size)
+        return rows[self.row_version[rows] > version]
+
+    # Строки автомобилей в радиусе от точки, отсортированные по расстоянию
+    def nearby(self, x, y, radius):
+        with self.lock:
+            rows = self.index.candidates(x, y, radius)
+            distance = np.hypot(self.x[rows] - x, self.y[rows] - y)
+        inside = distance <= radius
+        rows, distance = rows[inside], distance[inside]
+        order = np.argsort(distance, kind='stable')
+        return rows[order], distance[order]
+
+    # Один такт для всех едущих автомобилей.
+    # Возвращает строки, которые двигались, превысили скорость, покинули зону и вернулись в неё.
+    def tick(self):
+        with self.lock:
+            rows = np.flatnonzero(self.is_running[:self.size])
+            count = len(rows)
+            if count == 0:
+                return rows, rows, rows, rows
+
+            # Случайное изменение скорости с ограничением минимума 10 км/ч и максимума 80 км/ч
+            speed = self.speed[rows] + self.rng.uniform(-10, 10, count)
+            np.clip(speed, 10, 80, out=speed)
+            over = speed > self.max_speed
+            speeders = rows[over]
+            self.speed_violations[speeders] += 1
+            # Принудительно снижаем скорость до допустимой
+            speed[over] = self.max_speed
+            self.speed[rows] = speed
+
+            # Вне зоны обслуживания автомобиль направляется к центру ближайшей зоны
+            x = self.x[rows]
+            y = self.y[rows]
+            was_in_zone = self.in_zone[rows]
+            x_change = self.rng.uniform(-2, 2, count)
+            y_change = self.rng.uniform(-2, 2, count)
+            outside = ~was_in_zone
+            center_x, center_y = self.geofence.nearest_center(x[outside], y[outside])
+            x_change[outside] = np.abs(x_change[outside]) * np.where(x[outside] > center_x, -1, 1)
+            y_change[outside] = np.abs(y_change[outside]) * np.where(y[outside] > center_y, -1, 1)
+            x += x_change
+            y += y_change
+            self.x[rows] = x
+            self.y[rows] = y
+            self.index.move_many(rows, x, y)
+
+            in_zone = self.geofence.contains(x, y)
+            exits = rows[was_in_zone & ~in_zone]
+            returns = rows[outside & in_zone]
+            self.zone_violations[exits] += 1
+            self.in_zone[rows] = in_zone
+            self.version += 1
+            self.row_version[rows] = self.version
+            return rows, speeders, exits, returns
@@ -0,0 +1,183 @@
+import json
+import math
+import os
+
+import numpy as np
+
+# Размер ячейки сетки геозон по умолчанию (можно переопределить в файле зон)
+GEOFENCE_CELL_SIZE = float(os.getenv('GEOFENCE_CELL_SIZE', 5))
+
+SERVICE = 'service'
+EXCLUSION = 'exclusion'
+
+# Состояние ячейки сетки
+OUTSIDE = 0
+INSIDE = 1
+BORDER = 2
+
+
+# Лежат ли точки на отрезке
+def points_on_segment(x1, y1, x2, y2, x, y):
+    cross = (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)
+    tolerance = 1e-9 * max(abs(x2 - x1), abs(y2 - y1))
+    return ((np.abs(cross) <= tolerance) & (min(x1, x2) <= x) & (x <= max(x1, x2))
+            & (min(y1, y2) <= y) & (y <= max(y1, y2)))
+
+
+# Проверка попадания точек в многоугольник методом луча, векторно по всем точкам.
+# Точки на границе многоугольника относятся к нему, как и в прежней проверке прямоугольника.
+def points_in_polygon(polygon, x, y):
+    inside = np.zeros(len(x), dtype=bool)
+    on_border = np.zeros(len(x), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        on_border |= points_on_segment(x1, y1, x2, y2, x, y)
+        if y1 == y2:
+            continue
+        crosses = (y1 > y) != (y2 > y)
+        x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (x <= x_cross)
+    return inside | on_border
+
+
+# Пересекает ли отрезок прямоугольник (отсечение Лианга-Барски)
+def segment_hits_box(x1, y1, x2, y2, min_x, min_y, max_x, max_y):
+    t0, t1 = 0.0, 1.0
+    dx, dy = x2 - x1, y2 - y1
+    for p, q in ((-dx, x1 - min_x), (dx, max_x - x1), (-dy, y1 - min_y), (dy, max_y - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+            continue
+        t = q / p
+        if p < 0:
+            t0 = max(t0, t)
+        else:
+            t1 = min(t1, t)
+        if t0 > t1:
+            return False
+    return True
+
+
+class Zone:
+    def __init__(self, name, kind, polygon):
+        if kind not in (SERVICE, EXCLUSION):
+            raise ValueError(f"Неизвестный тип зоны {name}: {kind}")
+        if len(polygon) < 3:
+            raise ValueError(f"Зона {name} должна содержать не менее трёх вершин")
+        self.name = name
+        self.kind = kind
+        self.polygon = np.asarray(polygon, dtype=float)
+        self.min_x, self.min_y = self.polygon.min(axis=0)
+        self.max_x, self.max_y = self.polygon.max(axis=0)
+        self.center = ((self.min_x + self.max_x) / 2, (self.min_y + self.max_y) / 2)
+        # Ячейки сетки, через которые проходит граница зоны
+        self.border = None
+
+
+# Набор зон обслуживания с вложенными зонами исключения.
+# Границы зон заранее раскладываются по сетке: для ячеек целиком внутри
+# или снаружи ответ берётся из таблицы, точная проверка многоугольника
+# нужна только в ячейках, через которые проходит граница.
+class Geofence:
+    def __init__(self, zones, cell_size=GEOFENCE_CELL_SIZE):
+        self.service = [zone for zone in zones if zone.kind == SERVICE]
+        self.exclusion = [zone for zone in zones if zone.kind == EXCLUSION]
+        if not self.service:
+            raise ValueError("Не задано ни одной зоны обслуживания")
+        self.cell_size = cell_size
+        self.min_x = min(zone.min_x for zone in zones)
+        self.min_y = min(zone.min_y for zone in zones)
+        max_x = max(zone.max_x for zone in zones)
+        max_y = max(zone.max_y for zone in zones)
+        self.cols = math.floor((max_x - self.min_x) / cell_size) + 1
+        self.rows = math.floor((max_y - self.min_y) / cell_size) + 1
+        self.centers = np.array([zone.center for zone in self.service])
+
+        self.service_full = np.zeros((self.cols, self.rows), dtype=bool)
+        exclusion_full = np.zeros((self.cols, self.rows), dtype=bool)
+        service_border = np.zeros((self.cols, self.rows), dtype=bool)
+        exclusion_border = np.zeros((self.cols, self.rows), dtype=bool)
+        for zone in self.service:
+            self._rasterize(zone, self.service_full, service_border)
+        for zone in self.exclusion:
+            self._rasterize(zone, exclusion_full, exclusion_border)
+
+        self.state = np.full((self.cols, self.rows), OUTSIDE, dtype=np.int8)
+        self.state[self.service_full | service_border] = BORDER
+        self.state[self.service_full & ~exclusion_border] = INSIDE
+        self.state[exclusion_full] = OUTSIDE
+
+    def _cell_range(self, min_x, min_y, max_x, max_y):
+        return (max(math.floor((min_x - self.min_x) / self.cell_size), 0),
+                max(math.floor((min_y - self.min_y) / self.cell_size), 0),
+                min(math.floor((max_x - self.min_x) / self.cell_size), self.cols - 1),
+                min(math.floor((max_y - self.min_y) / self.cell_size), self.rows - 1))
+
+    def _rasterize(self, zone, full, border):
+        size = self.cell_size
+        zone.border = np.zeros((self.cols, self.rows), dtype=bool)
+        for (x1, y1), (x2, y2) in zip(zone.polygon, np.roll(zone.polygon, -1, axis=0)):
+            i0, j0, i1, j1 = self._cell_range(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    box_x, box_y = self.min_x + i * size, self.min_y + j * size
+                    if segment_hits_box(x1, y1, x2, y2, box_x, box_y, box_x + size, box_y + size):
+                        zone.border[i, j] = True
+        border |= zone.border
+
+        # Ячейки без границы целиком внутри или снаружи: достаточно проверить центр
+        i0, j0, i1, j1 = self._cell_range(zone.min_x, zone.min_y, zone.max_x, zone.max_y)
+        cols, rows = np.meshgrid(np.arange(i0, i1 + 1), np.arange(j0, j1 + 1), indexing='ij')
+        cols, rows = cols.ravel(), rows.ravel()
+        center_x = self.min_x + (cols + 0.5) * size
+        center_y = self.min_y + (rows + 0.5) * size
+        inside = points_in_polygon(zone.polygon, center_x, center_y) & ~zone.border[cols, rows]
+        full[cols[inside], rows[inside]] = True
+
+    # Пакетная проверка нахождения точек в зоне обслуживания
+    def contains(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        col = np.floor((x - self.min_x) / self.cell_size).astype(np.int64)
+        row = np.floor((y - self.min_y) / self.cell_size).astype(np.int64)
+        in_grid = (col >= 0) & (col < self.cols) & (row >= 0) & (row < self.rows)
+        result = np.zeros(x.shape, dtype=bool)
+        x, y, col, row = x[in_grid], y[in_grid], col[in_grid], row[in_grid]
+        state = self.state[col, row]
+        inside = state == INSIDE
+
+        border = np.flatnonzero(state == BORDER)
+        if len(border):
+            x, y, col, row = x[border], y[border], col[border], row[border]
+            in_service = self.service_full[col, row]
+            for zone in self.service:
+                check = zone.border[col, row] & ~in_service
+                if check.any():
+                    in_service[check] = points_in_polygon(zone.polygon, x[check], y[check])
+            excluded = np.zeros(len(border), dtype=bool)
+            for zone in self.exclusion:
+                check = zone.border[col, row] & ~excluded
+                if check.any():
+                    excluded[check] = points_in_polygon(zone.polygon, x[check], y[check])
+            inside[border] = in_service & ~excluded
+
+        result[in_grid] = inside
+        return result
+
+    def contains_point(self, x, y):
+        return bool(self.contains([x], [y])[0])
+
+    # Центр ближайшей зоны обслуживания для каждой точки
+    def nearest_center(self, x, y):
+        distance = (self.centers[:, 0][None, :] - np.asarray(x)[:, None]) ** 2 + \
+                   (self.centers[:, 1][None, :] - np.asarray(y)[:, None]) ** 2
+        nearest = np.argmin(distance, axis=1)
+        return self.centers[nearest, 0], self.centers[nearest, 1]
+
+
+# Загрузка зон из JSON файла
+def load_geofence(file_path):
+    with open(file_path, 'r') as file:
+        data = json.load(file)
+    zones = [Zone(zone['name'], zone['type'], zone['polygon']) for zone in data['zones']]
+    return Geofence(zones, data.get('cell_size', GEOFENCE_CELL_SIZE))
@@ -1,52 +1,79 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request
 from pathlib import Path
 import json
-import random
-import time
-import requests
+import numpy as np
 import os
 import threading
 from werkzeug.exceptions import HTTPException
 
+from . import http_client
+from .clock import make_clock
+from .fleet import FleetField, FleetState
+from .geofence import load_geofence
+from .registry import FREE, RUNNING, CarRegistry, car_state
+from .scheduler import FleetScheduler
+from .telemetry import TelemetryBuffer, TelemetryEncoder
+
 MANAGMENT_URL = 'http://management_system:8000'
 MAX_SPEED_LIMIT = 60  # максимально допустимая скорость в км/ч
-
-# Определяем разрешенную зону обслуживания (прямоугольная область)
-SERVICE_ZONE = {
-    'min_x': -50,
-    'max_x': 50,
-    'min_y': -50,
-    'max_y': 50
-}
+BASE_DIR = Path(__file__).resolve().parent.parent
 
 HOST = '0.0.0.0'
 PORT = 8000
 MODULE_NAME = os.getenv('MODULE_NAME')
+# Сколько ближайших автомобилей отдаёт /car/nearby по умолчанию
+NEARBY_LIMIT = int(os.getenv('NEARBY_LIMIT', 5))
 app = Flask(__name__)
 
+# Часы симуляции: реальные или виртуальные (режим задаётся CLOCK_MODE)
+clock = make_clock()
+# Зоны обслуживания и зоны исключения загружаются из файла
+geofence = load_geofence(f'{BASE_DIR}/data/zones.json')
+# Скорость, координаты и нарушения всех автомобилей хранятся в общих массивах
+fleet = FleetState(MAX_SPEED_LIMIT, geofence)
+# Реестр автомобилей по марке и по состоянию
+registry = CarRegistry()
+
 
 class Car:
+    # Объект автомобиля - представление строки состояния автопарка
+    speed = FleetField('speed', float)
+    is_running = FleetField('is_running', bool)
+    speed_violations = FleetField('speed_violations', int)
+    zone_violations = FleetField('zone_violations', int)
+    is_in_service_zone = FleetField('in_zone', bool)
+
     def __init__(self, brand, has_air_conditioner=False, has_heater=False, has_navigator=False):
-        self.speed = 0
-        self.coordinates = (0, 0)
+        self.fleet = fleet
+        self.row = fleet.allocate(self)
         self.occupied_by = None
         self.start_time = None
         self.brand = brand
         self.has_air_conditioner = has_air_conditioner
         self.has_heater = has_heater
         self.has_navigator = has_navigator
-        self.is_running = False
         self.tariff = None
-        self.speed_violations = 0
-        self.zone_violations = 0
-        self.is_in_service_zone = True
+
+    @property
+    def coordinates(self):
+        return float(self.fleet.x[self.row]), float(self.fleet.y[self.row])
+
+    @coordinates.setter
+    def coordinates(self, value):
+        self.fleet.move(self.row, *value)
+
+    # Отмечает изменение автомобиля в версии автопарка и в индексах реестра
+    def changed(self):
+        self.fleet.touch(self.row)
+        registry.update(self)
 
     def start(self):
         if not self.is_running:
             self.is_running = True
-            self.start_time = time.time()
+            self.start_time = clock.time()
             self.speed_violations = 0
             self.zone_violations = 0
+            self.changed()
             return f"{self.brand} поездка началась."
         else:
             return f"{self.brand} поездка ещё идет."
@@ -56,6 +83,7 @@ class Car:
             self.is_running = False
             self.speed = 0
             self.occupied_by = None
+            self.changed()
             return f"{self.brand} поездка завершена. Зафиксировано превышений скорости: {self.speed_violations}, нарушений зоны: {self.zone_violations}"
         else:
             return f"{self.brand} на парковке."
@@ -63,7 +91,7 @@ class Car:
     def get_status(self):
         elapsed_time = 0
         if self.start_time is not None and self.is_running:
-            elapsed_time = round(time.time() - self.start_time, 2)  # Время в секундах
+            elapsed_time = round(clock.time() - self.start_time, 2)  # Время в секундах
         return {
             "brand": self.brand,
             "is_running": self.is_running,
@@ -80,67 +108,75 @@ class Car:
             "is_in_service_zone": self.is_in_service_zone
         }
 
-    def check_service_zone(self, x, y):
-        in_zone = (SERVICE_ZONE['min_x'] <= x <= SERVICE_ZONE['max_x'] and
-                  SERVICE_ZONE['min_y'] <= y <= SERVICE_ZONE['max_y'])
-        if not in_zone and self.is_in_service_zone:
-            self.zone_violations += 1
-            self.is_in_service_zone = False
-            print(f"ВНИМАНИЕ: {self.brand} покинул зону обслуживания! Координаты: ({x:.2f}, {y:.2f})")
-        elif in_zone and not self.is_in_service_zone:
-            self.is_in_service_zone = True
-            print(f"{self.brand} вернулся в зону обслуживания")
-        return in_zone
-
-    def update_coordinates(self, x, y):
-        self.check_service_zone(x, y)
-        self.coordinates = (x, y)
-
-    def set_speed(self, speed):
-        if self.is_running:
-            self.speed = speed
-            if speed > MAX_SPEED_LIMIT:
-                self.speed_violations += 1
-                print(f"ВНИМАНИЕ: {self.brand} превысил скоростной режим! Скорость: {speed} км/ч")
-                # Принудительно снижаем скорость до допустимой
-                self.speed = MAX_SPEED_LIMIT
-            return f"Скорость {self.brand} изменена на {self.speed} км/ч."
-        else:
-            return f"{self.brand} не парковке, скорость не может быть изменена."
-
     def occupy(self, person, tarif):
         self.occupied_by = person
         self.tariff = tarif
+        self.changed()
         return f"{self.brand} арендован {self.occupied_by}."
 
 
-def simulate_drive(car):
-    while car.is_running:
-        # Генерируем более реалистичные изменения скорости
-        speed_change = random.uniform(-10, 10)
-        new_speed = max(10, min(car.speed + speed_change, 80))  # Ограничиваем минимум 10 км/ч
-        car.set_speed(new_speed)
-
-        # Если автомобиль вне зоны обслуживания, пытаемся вернуть его обратно
-        if not car.is_in_service_zone:
-            # Направляем автомобиль к центру зоны обслуживания
-            current_x, current_y = car.coordinates
-            x_direction = -1 if current_x > 0 else 1
-            y_direction = -1 if current_y > 0 else 1
-            x_change = random.uniform(0, 2) * x_direction
-            y_change = random.uniform(0, 2) * y_direction
+def send_telemetry_batch(statuses):
+    response = http_client.post(f'{MANAGMENT_URL}/telemetry/batch', json={'statuses': statuses})
+    response.raise_for_status()
+    # Система управления просит полный статус у автомобилей, для которых потеряла состояние
+    cars = (registry.get(brand) for brand in response.json().get('resync', []))
+    encoder.request_keyframe([car.row for car in cars if car is not None])
+
+
+# Значения полей дельты для строк автопарка
+DELTA_VALUES = {
+    'speed': lambda rows: fleet.speed[rows].tolist(),
+    'coordinates': lambda rows: zip(fleet.x[rows].tolist(), fleet.y[rows].tolist()),
+    'is_in_service_zone': lambda rows: fleet.in_zone[rows].tolist(),
+    'speed_violations': lambda rows: fleet.speed_violations[rows].tolist(),
+    'zone_violations': lambda rows: fleet.zone_violations[rows].tolist(),
+}
+
+
+# Сообщения телеметрии такта: полный статус собирается только для ключевых кадров,
+# дельты заполняются по столбцам изменившихся полей. ts - время такта по часам симуляции.
+def telemetry_messages(rows, keyframes, changed, seq, ts):
+    messages = []
+    for row, keyframe, number in zip(rows.tolist(), keyframes.tolist(), seq.tolist()):
+        car = fleet.owners[row]
+        if keyframe:
+            messages.append(dict(car.get_status(), kind='key', seq=number, ts=ts))
         else:
-            x_change = random.uniform(-2, 2)
-            y_change = random.uniform(-2, 2)
+            messages.append({'brand': car.brand, 'kind': 'delta', 'seq': number, 'ts': ts})
+    deltas = ~keyframes
+    for field, mask in changed.items():
+        index = np.flatnonzero(mask & deltas)
+        for i, value in zip(index.tolist(), DELTA_VALUES[field](rows[index])):
+            messages[i][field] = value
+    return messages
 
-        current_coordinates = car.coordinates
-        new_coordinates = (current_coordinates[0] + x_change, current_coordinates[1] + y_change)
-        car.update_coordinates(*new_coordinates)
 
-        print(f"{car.brand} Скорость: {car.speed:.2f} км/ч, Координаты: {car.coordinates}")
-        status = car.get_status()
-        requests.post(f'{MANAGMENT_URL}/telemetry/{car.brand}', json={'status': status})
-        time.sleep(1)
+# Такт и остановка автомобиля не пересекаются: после остановки такт
+# не сдвигает автомобиль и не добавляет его точки в телеметрию
+drive_lock = threading.Lock()
+
+
+# Один такт поездки всех едущих автомобилей, вызывается планировщиком автопарка
+def simulate_drive():
+    with drive_lock:
+        rows, speeders, exits, returns = fleet.tick()
+        for row in speeders:
+            car = fleet.owners[row]
+            print(f"ВНИМАНИЕ: {car.brand} превысил скоростной режим! Скорость ограничена до {MAX_SPEED_LIMIT} км/ч")
+        for row in exits:
+            car = fleet.owners[row]
+            x, y = car.coordinates
+            print(f"ВНИМАНИЕ: {car.brand} покинул зону обслуживания! Координаты: ({x:.2f}, {y:.2f})")
+        for row in returns:
+            print(f"{fleet.owners[row].brand} вернулся в зону обслуживания")
+
+        telemetry.extend(telemetry_messages(*encoder.encode(fleet, rows), clock.time()))
+        return len(rows)
+
+
+encoder = TelemetryEncoder(speed_limit=MAX_SPEED_LIMIT)
+telemetry = TelemetryBuffer(send_telemetry_batch)
+scheduler = FleetScheduler(simulate_drive, clock=clock)
 
 
 # Функция для загрузки автомобилей из JSON файла
@@ -150,24 +186,94 @@ def load_cars_from_json(file_path):
         return [Car(**car) for car in cars_data]
 
 
-BASE_DIR = Path(__file__).resolve().parent.parent
 # Загружаем список автомобилей из файла
-cars = load_cars_from_json(f'{BASE_DIR}/data/cars.json')
+registry.extend(load_cars_from_json(f'{BASE_DIR}/data/cars.json'))
 
 
+def project_status(car, fields):
+    status = car.get_status()
+    if fields:
+        status = {field: status[field] for field in fields if field in status}
+    return status
+
+
+# Статусы автомобилей с фильтрами, проекцией полей, постраничным выводом и потоковой выдачей
 @app.route('/car/status/all', methods=['GET'])
 def get_all_car_statuses():
-    statuses = [car.get_status() for car in cars]
-    return jsonify(statuses)
+    # Версия автопарка служит ETag: если ничего не менялось, отвечаем 304 без тела
+    etag = str(fleet.version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    only_free = request.args.get('free', 'false').lower() == 'true'
+    only_running = request.args.get('running', 'false').lower() == 'true'
+    changed_since = request.args.get('changed_since', type=int)
+    cursor = request.args.get('cursor', -1, type=int)
+    limit = request.args.get('limit', type=int)
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+
+    if only_free or only_running:
+        state = FREE if only_free else RUNNING
+        rows = np.sort(np.array([car.row for car in registry.cars_in_state(state)], dtype=np.int64))
+    else:
+        rows = np.arange(fleet.size)
+    if changed_since is not None:
+        rows = fleet.changed_since(changed_since, rows)
+    rows = rows[rows > cursor]
+    next_cursor = None
+    if limit is not None and 0 < limit < len(rows):
+        rows = rows[:limit]
+        next_cursor = int(rows[-1])
+    cars = [fleet.owners[row] for row in rows.tolist()]
+
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        def generate():
+            for car in cars:
+                yield json.dumps(project_status(car, fields), ensure_ascii=False) + '\n'
+        response = Response(generate(), mimetype='application/x-ndjson')
+    else:
+        response = jsonify([project_status(car, fields) for car in cars])
+    response.set_etag(etag)
+    response.headers['X-Fleet-Version'] = etag
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+
+# Ближайшие к точке автомобили (по умолчанию только свободные)
+@app.route('/car/nearby', methods=['GET'])
+def get_nearby_cars():
+    x = request.args.get('x', type=float)
+    y = request.args.get('y', type=float)
+    radius = request.args.get('radius', type=float)
+    limit = request.args.get('k', NEARBY_LIMIT, type=int)
+    only_free = request.args.get('free', 'true').lower() != 'false'
+    if x is None or y is None or radius is None or radius < 0 or limit < 1:
+        return jsonify({"error": "Укажите координаты x, y, радиус radius >= 0 и k >= 1."}), 400
+    rows, distances = fleet.nearby(x, y, radius)
+    nearby = []
+    for row, distance in zip(rows.tolist(), distances.tolist()):
+        car = fleet.owners[row]
+        if only_free and car_state(car) != FREE:
+            continue
+        status = car.get_status()
+        status['distance'] = round(distance, 2)
+        nearby.append(status)
+        if len(nearby) == limit:
+            break
+    return jsonify(nearby)
 
 
 @app.route('/car/start/<string:brand>', methods=['POST'])
 def start_car(brand):
-    car = next((car for car in cars if car.brand.lower() == brand.lower()), None)
+    car = registry.get(brand)
     if car:
         message = car.start()
-        thread = threading.Thread(target=simulate_drive, args=(car,))
-        thread.start()
+        # Новая поездка начинается с полного статуса
+        encoder.request_keyframe([car.row])
+        scheduler.wake()
         return jsonify({"message": message})
     else:
         return jsonify({"error": "Автомобиль не найден."}), 404
@@ -175,16 +281,23 @@ def start_car(brand):
 
 @app.route('/car/stop/<string:brand>', methods=['POST'])
 def stop_car(brand):
-    car = next((car for car in cars if car.brand.lower() == brand.lower()), None)
+    car = registry.get(brand)
     if car:
-        status = car.get_status()
-        invoice_id = requests.post(f'{MANAGMENT_URL}/return/{car.occupied_by}', json={'status': status})
-        if invoice_id.status_code == 200:
-            invoice_id = invoice_id.json()['id']
+        # Сначала останавливаем автомобиль, чтобы после возврата по нему не пришло точек поездки
+        with drive_lock:
+            status = car.get_status()
+            person = car.occupied_by
+            stopped_at = clock.time()
+            seq = encoder.last_seq(car.row)
             message = car.stop()
-            return jsonify({"message": message, 'invoice_id': invoice_id})
+        # Система управления считает нарушения по телеметрии: досылаем накопленные точки до возврата.
+        # По номеру последнего сообщения она проверяет, что телеметрия поездки дошла целиком.
+        telemetry.flush()
+        response = http_client.post(f'{MANAGMENT_URL}/return/{person}',
+                                    json={'status': status, 'ts': stopped_at, 'seq': seq})
+        if response.status_code == 200:
+            return jsonify({"message": message, 'invoice_id': response.json()['id']})
         else:
-            message = car.stop()
             return jsonify({"message": message}), 404
     else:
         return jsonify({"error": "Автомобиль не найден."}), 404
@@ -192,7 +305,7 @@ def stop_car(brand):
 
 @app.route('/car/status/<string:brand>', methods=['GET'])
 def get_car_status(brand):
-    car = next((car for car in cars if car.brand.lower() == brand.lower()), None)
+    car = registry.get(brand)
     if car:
         status = car.get_status()
         return jsonify(status)
@@ -202,13 +315,15 @@ def get_car_status(brand):
 
 @app.route('/car/occupy/<string:person>', methods=['POST'])
 def occupy_car(person):
-    response = requests.post(f'{MANAGMENT_URL}/access/{person}')
+    response = http_client.post(f'{MANAGMENT_URL}/access/{person}')
     if response.status_code == 200:
         brand = response.json()['car']
-        car = next((car for car in cars if car.brand.lower() == brand.lower()), None)
+        car = registry.get(brand)
         if car and person is not None:
             tariff = response.json()['tariff']
             message = car.occupy(person, tariff)
+            # Арендатор и тариф передаются только в ключевом кадре
+            encoder.request_keyframe([car.row])
             return jsonify({"access": True, "car": car.brand, "message": message})
         else:
             return jsonify({"access": False, "message": "Автомобиль не найден или не указан клиент."}), 404
@@ -216,6 +331,31 @@ def occupy_car(person):
         return jsonify({"access": False, "message": "Доступ до автомобиля не разрешен."}), 404
 
 
+@app.route('/clock', methods=['GET'])
+def get_clock():
+    return jsonify(clock.to_dict())
+
+
+# Сдвиг виртуального времени на заданное число секунд (только для ручного режима часов)
+@app.route('/clock/advance', methods=['POST'])
+def advance_clock():
+    if not clock.manual:
+        return jsonify({"error": "Сдвиг времени доступен только в режиме CLOCK_MODE=manual."}), 409
+    seconds = request.args.get('seconds', type=float)
+    if seconds is None and request.is_json:
+        seconds = request.json.get('seconds')
+    if seconds is None or seconds < 0:
+        return jsonify({"error": "Укажите число секунд seconds >= 0."}), 400
+    ticks = scheduler.advance(seconds)
+    return jsonify({"ticks": ticks, **clock.to_dict()})
+
+
+# Статистика вызовов других сервисов
+@app.route('/http/stats', methods=['GET'])
+def get_http_stats():
+    return jsonify(http_client.stats())
+
+
 @app.errorhandler(HTTPException)
 def handle_exception(e):
     response = e.get_response()
@@ -0,0 +1,74 @@
+import threading
+
+FREE = 'free'
+OCCUPIED = 'occupied'
+RUNNING = 'running'
+
+
+def car_key(brand):
+    return brand.casefold()
+
+
+def car_state(car):
+    if car.is_running:
+        return RUNNING
+    if car.occupied_by is not None:
+        return OCCUPIED
+    return FREE
+
+
+# Реестр автомобилей: поиск по марке без учёта регистра за O(1)
+# и индексы по состоянию (свободен, арендован, в поездке)
+class CarRegistry:
+    def __init__(self):
+        self._by_key = {}
+        self._state_of = {}
+        # Словари используются как упорядоченные множества: ключ -> автомобиль
+        self._by_state = {FREE: {}, OCCUPIED: {}, RUNNING: {}}
+        self._lock = threading.Lock()
+
+    def add(self, car):
+        key = car_key(car.brand)
+        with self._lock:
+            if key in self._by_key:
+                print(f"Автомобиль {car.brand} уже зарегистрирован, запись пропущена")
+                return self._by_key[key]
+            state = car_state(car)
+            self._by_key[key] = car
+            self._state_of[key] = state
+            self._by_state[state][key] = car
+            return car
+
+    def extend(self, cars):
+        for car in cars:
+            self.add(car)
+
+    def get(self, brand):
+        return self._by_key.get(car_key(brand))
+
+    # Перекладывает автомобиль в индекс его текущего состояния
+    def update(self, car):
+        key = car_key(car.brand)
+        with self._lock:
+            if self._by_key.get(key) is not car:
+                return
+            state = car_state(car)
+            previous = self._state_of[key]
+            if state != previous:
+                del self._by_state[previous][key]
+                self._by_state[state][key] = car
+                self._state_of[key] = state
+
+    def cars_in_state(self, state):
+        with self._lock:
+            return list(self._by_state[state].values())
+
+    def count(self, state):
+        return len(self._by_state[state])
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._by_key.values()))
+
+    def __len__(self):
+        return len(self._by_key)
@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+
+from .clock import RealClock
+
+# Период одного такта симуляции в секундах (по умолчанию 1 такт в секунду)
+TICK_INTERVAL = float(os.getenv('TICK_INTERVAL', 1))
+
+
+# Единый цикл симуляции: за один такт продвигает все едущие автомобили разом.
+# Вместо отдельного потока на каждую поездку используется один поток,
+# поэтому число потоков не растёт вместе с автопарком. Какие автомобили едут,
+# решает состояние автопарка: планировщик только задаёт такты и засыпает,
+# когда очередной такт никого не сдвинул.
+class FleetScheduler:
+    def __init__(self, step, interval=TICK_INTERVAL, clock=None):
+        self.step = step
+        self.interval = interval
+        self.clock = clock or RealClock()
+        self.ticks = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    # Будит цикл после начала поездки
+    def wake(self):
+        with self._lock:
+            # В ручном режиме часов такты выполняются только по запросу
+            if self._thread is None and not self.clock.manual:
+                self._thread = threading.Thread(target=self._loop, name='fleet-scheduler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    # Возвращает число автомобилей, сдвинутых за такт
+    def tick(self):
+        try:
+            moved = self.step()
+        except Exception as e:
+            print(f"Ошибка симуляции автопарка: {e}")
+            moved = 0
+        self.clock.advance(self.interval)
+        self.ticks += 1
+        return moved
+
+    # Ручной сдвиг времени: выполняет такты, укладывающиеся в заданное число секунд
+    def advance(self, seconds):
+        ticks = int(round(seconds / self.interval))
+        for _ in range(ticks):
+            self.tick()
+        return ticks
+
+    def _loop(self):
+        interval = self.clock.real_interval(self.interval)
+        next_tick = time.monotonic()
+        while True:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._wakeup.clear()
+            moved = self.tick()
+            next_tick += interval
+            if not moved:
+                # Пока никто не едет, поток спит до следующей поездки
+                self._wakeup.wait()
+                next_tick = time.monotonic() + interval
+            elif next_tick < time.monotonic():
+                # Такт не уложился в интервал: не догоняем пачкой, а сдвигаем расписание
+                next_tick = time.monotonic()
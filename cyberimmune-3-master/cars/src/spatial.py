@@ -0,0 +1,86 @@
+import math
+import os
+
+import numpy as np
+
+# Размер ячейки равномерной сетки пространственного индекса
+GRID_CELL_SIZE = float(os.getenv('GRID_CELL_SIZE', 10))
+
+
+# Пространственный индекс автопарка на равномерной сетке.
+# Хранит номера строк состояния автопарка по ячейкам и обновляется
+# только для автомобилей, перешедших в другую ячейку.
+class GridIndex:
+    def __init__(self, cell_size=GRID_CELL_SIZE, capacity=1024):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.cell_x = np.zeros(capacity, dtype=np.int64)
+        self.cell_y = np.zeros(capacity, dtype=np.int64)
+
+    def cell_of(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def _grow(self, row):
+        capacity = len(self.cell_x)
+        while capacity <= row:
+            capacity *= 2
+        for name in ('cell_x', 'cell_y'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _add(self, row, cell):
+        self.cell_x[row], self.cell_y[row] = cell
+        self.cells.setdefault(cell, set()).add(row)
+
+    def _remove(self, row):
+        cell = (int(self.cell_x[row]), int(self.cell_y[row]))
+        bucket = self.cells[cell]
+        bucket.discard(row)
+        if not bucket:
+            del self.cells[cell]
+
+    def insert(self, row, x, y):
+        if row >= len(self.cell_x):
+            self._grow(row)
+        self._add(row, self.cell_of(x, y))
+
+    def move(self, row, x, y):
+        cell = self.cell_of(x, y)
+        if cell != (self.cell_x[row], self.cell_y[row]):
+            self._remove(row)
+            self._add(row, cell)
+
+    def move_many(self, rows, x, y):
+        cell_x = np.floor(x / self.cell_size).astype(np.int64)
+        cell_y = np.floor(y / self.cell_size).astype(np.int64)
+        changed = (cell_x != self.cell_x[rows]) | (cell_y != self.cell_y[rows])
+        moved = rows[changed]
+        old_cells = zip(self.cell_x[moved].tolist(), self.cell_y[moved].tolist())
+        new_cells = zip(cell_x[changed].tolist(), cell_y[changed].tolist())
+        self.cell_x[moved] = cell_x[changed]
+        self.cell_y[moved] = cell_y[changed]
+        cells = self.cells
+        for row, old_cell, new_cell in zip(moved.tolist(), old_cells, new_cells):
+            bucket = cells[old_cell]
+            bucket.discard(row)
+            if not bucket:
+                del cells[old_cell]
+            cells.setdefault(new_cell, set()).add(row)
+
+    # Строки из ячеек, пересекающих квадрат вокруг окружности поиска
+    def candidates(self, x, y, radius):
+        min_x, min_y = self.cell_of(x - radius, y - radius)
+        max_x, max_y = self.cell_of(x + radius, y + radius)
+        rows = []
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self.cells):
+            # Большой радиус: дешевле пройти только по занятым ячейкам
+            for (cell_x, cell_y), bucket in self.cells.items():
+                if min_x <= cell_x <= max_x and min_y <= cell_y <= max_y:
+                    rows.extend(bucket)
+        else:
+            for cell_x in range(min_x, max_x + 1):
+                for cell_y in range(min_y, max_y + 1):
+                    rows.extend(self.cells.get((cell_x, cell_y), ()))
+        return np.array(rows, dtype=np.int64)
@@ -0,0 +1,163 @@
+import os
+import threading
+
+import numpy as np
+
+# Максимальное число статусов в одном пакете телеметрии
+TELEMETRY_BATCH_SIZE = int(os.getenv('TELEMETRY_BATCH_SIZE', 5000))
+# Максимальное время накопления пакета в секундах
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv('TELEMETRY_FLUSH_INTERVAL', 1))
+# Сколько статусов держим в буфере, пока система управления недоступна
+TELEMETRY_MAX_PENDING = int(os.getenv('TELEMETRY_MAX_PENDING', 10 * TELEMETRY_BATCH_SIZE))
+# Через сколько тактов автомобиль отправляет полный статус (ключевой кадр)
+TELEMETRY_KEYFRAME_INTERVAL = int(os.getenv('TELEMETRY_KEYFRAME_INTERVAL', 30))
+# Минимальные изменения скорости (км/ч) и координат, которые попадают в телеметрию
+TELEMETRY_SPEED_THRESHOLD = float(os.getenv('TELEMETRY_SPEED_THRESHOLD', 5))
+TELEMETRY_POSITION_THRESHOLD = float(os.getenv('TELEMETRY_POSITION_THRESHOLD', 5))
+
+# Кодировщик телеметрии: изредка полный статус (ключевой кадр), в остальное время
+# только изменившиеся поля. Скорость и координаты попадают в дельту, только если
+# изменились больше порога, нарушения, смена зоны и переход через ограничение скорости - всегда.
+# Время поездки, арендатор и тариф передаются только в ключевых кадрах.
+# Последние отправленные значения хранятся в массивах по строкам автопарка,
+# поэтому изменения всех едущих автомобилей определяются несколькими операциями над массивами.
+class TelemetryEncoder:
+    def __init__(self, keyframe_interval=TELEMETRY_KEYFRAME_INTERVAL, speed_threshold=TELEMETRY_SPEED_THRESHOLD,
+                 position_threshold=TELEMETRY_POSITION_THRESHOLD, speed_limit=None, capacity=1024):
+        self.keyframe_interval = keyframe_interval
+        self.speed_limit = speed_limit
+        self.speed_threshold = speed_threshold
+        self.position_threshold = position_threshold
+        self._sent = np.zeros(capacity, dtype=bool)
+        self._resync = np.zeros(capacity, dtype=bool)
+        self._since_keyframe = np.zeros(capacity, dtype=np.int64)
+        self._seq = np.zeros(capacity, dtype=np.int64)
+        self._speed = np.zeros(capacity)
+        self._x = np.zeros(capacity)
+        self._y = np.zeros(capacity)
+        self._in_zone = np.ones(capacity, dtype=bool)
+        self._speed_violations = np.zeros(capacity, dtype=np.int64)
+        self._zone_violations = np.zeros(capacity, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def _reserve(self, rows):
+        if len(rows) == 0 or rows.max() < len(self._sent):
+            return
+        capacity = max(2 * len(self._sent), int(rows.max()) + 1)
+        for name in ('_sent', '_resync', '_since_keyframe', '_seq', '_speed', '_x', '_y', '_in_zone',
+                     '_speed_violations', '_zone_violations'):
+            old = getattr(self, name)
+            new = np.ones(capacity, dtype=old.dtype) if name == '_in_zone' else np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    # Следующее сообщение автомобилей в этих строках будет ключевым кадром
+    def request_keyframe(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        with self._lock:
+            self._reserve(rows)
+            self._resync[rows] = True
+
+    # Номер последнего сообщения автомобиля в строке row
+    def last_seq(self, row):
+        with self._lock:
+            return int(self._seq[row]) if row < len(self._seq) else 0
+
+    # Кодирует такт для строк автопарка rows. Возвращает строки, по которым есть сообщение,
+    # признак ключевого кадра, изменившиеся поля (маски по этим строкам) и номера сообщений.
+    def encode(self, fleet, rows):
+        speed = fleet.speed[rows]
+        x = fleet.x[rows]
+        y = fleet.y[rows]
+        in_zone = fleet.in_zone[rows]
+        speed_violations = fleet.speed_violations[rows]
+        zone_violations = fleet.zone_violations[rows]
+        with self._lock:
+            self._reserve(rows)
+            since_keyframe = self._since_keyframe[rows] + 1
+            keyframes = ~self._sent[rows] | self._resync[rows] | (since_keyframe >= self.keyframe_interval)
+            sent_speed = self._speed[rows]
+            speed_changed = np.abs(speed - sent_speed) >= self.speed_threshold
+            if self.speed_limit is not None:
+                speed_changed |= (speed >= self.speed_limit) != (sent_speed >= self.speed_limit)
+            changed = {
+                'speed': speed_changed,
+                'coordinates': np.hypot(x - self._x[rows], y - self._y[rows]) >= self.position_threshold,
+                'is_in_service_zone': in_zone != self._in_zone[rows],
+                'speed_violations': speed_violations != self._speed_violations[rows],
+                'zone_violations': zone_violations != self._zone_violations[rows],
+            }
+            emit = keyframes.copy()
+            for mask in changed.values():
+                emit |= mask
+
+            # Запоминаем отправленное: в ключевом кадре все поля, в дельте - только изменившиеся
+            sent = rows[speed_changed | keyframes]
+            self._speed[sent] = fleet.speed[sent]
+            sent = rows[changed['coordinates'] | keyframes]
+            self._x[sent] = fleet.x[sent]
+            self._y[sent] = fleet.y[sent]
+            sent = rows[changed['is_in_service_zone'] | keyframes]
+            self._in_zone[sent] = fleet.in_zone[sent]
+            sent = rows[changed['speed_violations'] | keyframes]
+            self._speed_violations[sent] = fleet.speed_violations[sent]
+            sent = rows[changed['zone_violations'] | keyframes]
+            self._zone_violations[sent] = fleet.zone_violations[sent]
+
+            self._since_keyframe[rows] = np.where(keyframes, 0, since_keyframe)
+            self._sent[rows[keyframes]] = True
+            self._resync[rows[keyframes]] = False
+            rows = rows[emit]
+            self._seq[rows] += 1
+            return rows, keyframes[emit], {field: mask[emit] for field, mask in changed.items()}, self._seq[rows]
+
+
+# Буфер телеметрии: статусы копятся и отправляются одним запросом
+# при заполнении пакета или по истечении интервала
+class TelemetryBuffer:
+    def __init__(self, send, batch_size=TELEMETRY_BATCH_SIZE, flush_interval=TELEMETRY_FLUSH_INTERVAL,
+                 max_pending=TELEMETRY_MAX_PENDING):
+        self.send = send
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.sent_batches = 0
+        self.dropped = 0
+        self._statuses = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+
+    def extend(self, statuses):
+        with self._lock:
+            self._statuses.extend(statuses)
+            overflow = len(self._statuses) - self.max_pending
+            if overflow > 0:
+                # Отбрасываем самые старые статусы, новые важнее
+                del self._statuses[:overflow]
+                self.dropped += overflow
+            if len(self._statuses) >= self.batch_size:
+                self._ready.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='telemetry-flush', daemon=True)
+                self._thread.start()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                statuses, self._statuses = self._statuses, []
+            for start in range(0, len(statuses), self.batch_size):
+                batch = statuses[start:start + self.batch_size]
+                try:
+                    self.send(batch)
+                    self.sent_batches += 1
+                except Exception as e:
+                    print(f"Ошибка отправки пакета телеметрии ({len(batch)} статусов): {e}")
+            return len(statuses)
+
+    def _loop(self):
+        while True:
+            self._ready.wait(self.flush_interval)
+            self._ready.clear()
+            self.flush()
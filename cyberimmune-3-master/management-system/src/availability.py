@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+
+# Через сколько секунд список свободных автомобилей сверяется с сервисом автомобилей
+AVAILABILITY_TTL = float(os.getenv('AVAILABILITY_TTL', 5))
+
+
+# Локальный список свободных автомобилей. Обновляется событиями аренды и возврата
+# (не телеметрией: она может дойти уже после возврата), а по истечении TTL
+# сверяется с сервисом автомобилей по версии автопарка: запрашиваются только
+# строки, изменившиеся с последней сверки.
+class AvailabilityCache:
+    def __init__(self, fetch, ttl=AVAILABILITY_TTL):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.version = None
+        self._free = {}
+        self._body = None
+        self._refreshed_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _set(self, brand, free):
+        with self._lock:
+            if free == (brand in self._free):
+                return
+            if free:
+                self._free[brand] = None
+            else:
+                del self._free[brand]
+            self._body = None
+
+    def mark_busy(self, brand):
+        self._set(brand, False)
+
+    def mark_free(self, brand):
+        self._set(brand, True)
+
+    # Сверка с сервисом автомобилей: полный список при первом запросе, далее только изменения
+    def refresh(self):
+        try:
+            cars, version = self.fetch(self.version)
+        except Exception as e:
+            print(f"Ошибка обновления списка свободных автомобилей: {e}")
+            return False
+        finally:
+            self._refreshing = False
+        with self._lock:
+            if cars is not None:
+                if self.version is None:
+                    self._free = {}
+                for car in cars:
+                    if car['occupied_by'] is None and not car['is_running']:
+                        self._free[car['brand']] = None
+                    else:
+                        self._free.pop(car['brand'], None)
+                self._body = None
+            self.version = version
+            self._refreshed_at = time.monotonic()
+        return True
+
+    def age(self):
+        if self._refreshed_at is None:
+            return None
+        return time.monotonic() - self._refreshed_at
+
+    # Готовый JSON со списком свободных автомобилей и его возраст в секундах
+    def snapshot(self):
+        if self._refreshed_at is None:
+            self.refresh()
+        elif self.age() > self.ttl and not self._refreshing:
+            # Устаревшие данные отдаём сразу, сверка идёт в фоне
+            self._refreshing = True
+            threading.Thread(target=self.refresh, name='availability-refresh', daemon=True).start()
+        with self._lock:
+            if self._body is None:
+                self._body = json.dumps(list(self._free))
+            return self._body, self.age()
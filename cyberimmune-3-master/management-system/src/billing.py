@@ -0,0 +1,83 @@
+import numpy as np
+
+
+# Цены тарифов, штрафы и надбавки за функции автомобиля берутся
+# из скомпилированной таблицы тарифов (см. tariffs.py)
+def counter_prepayment(car, table):
+    counter = 0
+    for feature, price in table.features.items():
+        if car[feature]:
+            counter += price
+    return counter
+
+
+def counter_payment(trip_time, tariff, experience, speed_violations, zone_violations, table):
+    counter = 0
+    params = table.tariffs.get(tariff)
+    if params is not None:
+        if experience < table.novice_experience:
+            counter += round(trip_time / params.novice_time_unit * params.rate * params.novice_multiplier, 2)
+        else:
+            counter += round(trip_time / params.time_unit * params.rate / experience, 2)
+
+    # Штрафы за превышение скорости и за выезд из зоны обслуживания
+    if speed_violations > 0:
+        counter += speed_violations * table.speed_penalty
+    if zone_violations > 0:
+        counter += zone_violations * table.zone_penalty
+    return counter
+
+
+# Округление до копеек, совпадающее с round() Python: почти половинные значения,
+# где округление NumPy может разойтись, досчитываются поштучно
+def round_cents(values):
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if tie.any():
+        rounded[tie] = [round(value, 2) for value in values[tie].tolist()]
+    return rounded
+
+
+# Пакетный расчёт стоимости поездок, результат совпадает с counter_payment для каждой поездки
+def batch_payment(trip_time, tariff, experience, speed_violations, zone_violations, table):
+    trip_time = np.asarray(trip_time, dtype=float)
+    tariff = np.asarray(tariff, dtype=object)
+    experience = np.asarray(experience, dtype=float)
+    novice = experience < table.novice_experience
+    # Для новичков опыт в расчёте не участвует, подставляем 1, чтобы не делить на ноль
+    safe_experience = np.where(novice, 1, experience)
+
+    base = np.zeros(len(trip_time))
+    for name, params in table.tariffs.items():
+        selected = tariff == name
+        base = np.where(selected & novice,
+                        trip_time / params.novice_time_unit * params.rate * params.novice_multiplier, base)
+        base = np.where(selected & ~novice, trip_time / params.time_unit * params.rate / safe_experience, base)
+
+    speed_violations = np.asarray(speed_violations)
+    zone_violations = np.asarray(zone_violations)
+    # Штрафы прибавляются по очереди, как в counter_payment, чтобы совпадало округление сумм
+    counter = round_cents(base)
+    counter += np.where(speed_violations > 0, speed_violations * table.speed_penalty, 0)
+    counter += np.where(zone_violations > 0, zone_violations * table.zone_penalty, 0)
+    return counter
+
+
+# Столбцы пакета: принимается список объектов или объект со списками значений по полям
+def batch_columns(items, fields):
+    if isinstance(items, dict):
+        columns = [list(items[field]) for field in fields]
+    else:
+        columns = [[item[field] for item in items] for field in fields]
+    if len({len(column) for column in columns}) > 1:
+        raise ValueError('Columns must have the same length')
+    return columns
+
+
+# Пакетный расчёт предоплаты: столбцы значений функций в порядке table.features
+def batch_prepayment(features, table):
+    counter = np.zeros(len(features[0]) if features else 0, dtype=int)
+    for column, price in zip(features, table.features.values()):
+        counter = counter + np.asarray(column, dtype=bool) * price
+    return counter
@@ -0,0 +1,47 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .http_client import HostStats
+
+# Число потоков для параллельных вызовов других сервисов из обработчиков
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', 16))
+
+
+# Параллельный запуск независимых вызовов других сервисов на общем пуле потоков
+# ограниченного размера со статистикой времени по каждому шагу (hop)
+class Fanout:
+    def __init__(self, max_workers=FANOUT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fanout')
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _record(self, hop, elapsed, failed):
+        with self._lock:
+            stats = self._stats.get(hop)
+            if stats is None:
+                stats = self._stats[hop] = HostStats()
+            stats.record(elapsed, failed)
+
+    @contextmanager
+    def timed(self, hop):
+        failed = True
+        start = time.perf_counter()
+        try:
+            yield
+            failed = False
+        finally:
+            self._record(hop, time.perf_counter() - start, failed)
+
+    def call(self, hop, func, *args, **kwargs):
+        with self.timed(hop):
+            return func(*args, **kwargs)
+
+    def submit(self, hop, func, *args, **kwargs):
+        return self._executor.submit(self.call, hop, func, *args, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {hop: stats.to_dict() for hop, stats in self._stats.items()}
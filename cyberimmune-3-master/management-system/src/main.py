@@ -1,10 +1,26 @@
-import requests
+import json
+import math
 import os
-from flask import Flask, jsonify, request
+import time
+from datetime import datetime
+from flask import Flask, Response, jsonify, request
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import SQLAlchemyError
 import threading
 from werkzeug.exceptions import HTTPException
 
+from . import http_client
+from .storage import add_column, configure_engine, create_index, migrate
+from .availability import AvailabilityCache
+from .fanout import Fanout
+from .billing import batch_columns, batch_payment, batch_prepayment, counter_payment, counter_prepayment
+from .stream import FleetStream
+from .tariffs import TariffBook
+from .telemetry import TelemetryDecoder
+from .timeseries import TelemetryStore
+from .violations import ViolationAggregator
+
 HOST = '0.0.0.0'
 PORT = 8000
 MODULE_NAME = os.getenv('MODULE_NAME')
@@ -12,20 +28,39 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///clients.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
+with app.app_context():
+    configure_engine(db.engine)
 
 PAYMENT_URL = 'http://payment_system:8000'
 CARS_URL = 'http://cars:8000'
 
-TARIFF = ["min", "hour"]
+MAX_SPEED_LIMIT = 60  # максимально допустимая скорость в км/ч
+TRIP_FIELDS = ('trip_time', 'tariff', 'experience', 'speed_violations', 'zone_violations')
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Таблица тарифов из файла, перезагружается при его изменении
+tariffs = TariffBook(os.path.join(BASE_DIR, 'data', 'tariffs.json'))
+
+# Последние известные статусы автомобилей, восстановленные из телеметрии
+telemetry_decoder = TelemetryDecoder()
+# История телеметрии пишется в отдельную базу временных рядов (открывается при старте сервиса)
+telemetry_store = TelemetryStore(os.path.join(app.instance_path, 'telemetry.db'))
+# Поток положений автопарка для панелей наблюдения
+fleet_stream = FleetStream()
+# Независимые вызовы других сервисов выполняются параллельно
+fanout = Fanout()
+# Нарушения текущих поездок считаются по телеметрии, а не по итогам от автомобиля
+violation_aggregator = ViolationAggregator(MAX_SPEED_LIMIT)
 
 
 # Модель для хранения поездок клиентов
 class Client(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_name = db.Column(db.String(100), nullable=False)
+    client_name = db.Column(db.String(100), nullable=False, unique=True, index=True)
     experience = db.Column(db.Integer, nullable=False)
     car = db.Column(db.String(100))
     prepayment = db.Column(db.Integer)
+    prepayment_id = db.Column(db.Integer)
     prepayment_status = db.Column(db.String(100))
     tariff = db.Column(db.String(100))
     elapsed_time = db.Column(db.Float)
@@ -33,95 +68,265 @@ class Client(db.Model):
     zone_violations = db.Column(db.Integer, default=0)
 
 
-# Инициализация базы данных
-@app.before_first_request
-def create_tables():
-    db.create_all()
+# Завершённые поездки клиентов
+class Trip(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False, index=True)
+    invoice_id = db.Column(db.Integer, unique=True, index=True)
+    car = db.Column(db.String(100))
+    tariff = db.Column(db.String(100))
+    elapsed_time = db.Column(db.Float)
+    prepayment = db.Column(db.Integer)
+    amount = db.Column(db.Float)
+    speed_violations = db.Column(db.Integer, default=0)
+    zone_violations = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Финальный чек в том виде, в котором он отдаётся клиенту
+    receipt = db.Column(db.Text)
 
 
-def counter_prepayment(car):
-    counter = 0
-    if car['has_air_conditioner']:
-        counter += 7
-    if car['has_heater']:
-        counter += 5
-    if car['has_navigator']:
-        counter += 10
-    return counter
+# Итоги по поездкам клиента, обновляются вместе с записью поездки
+class ClientStats(db.Model):
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), primary_key=True)
+    trips = db.Column(db.Integer, nullable=False, default=0, index=True)
+    total_time = db.Column(db.Float, nullable=False, default=0, index=True)
+    total_spend = db.Column(db.Float, nullable=False, default=0, index=True)
+    speed_violations = db.Column(db.Integer, nullable=False, default=0)
+    zone_violations = db.Column(db.Integer, nullable=False, default=0)
+    last_trip_at = db.Column(db.DateTime)
 
 
-def counter_payment(trip_time, tariff, experience, speed_violations, zone_violations):
-    tariff_min = 2
-    tariff_hours = 80
-    counter = 0
-    if tariff == 'min':
-        if experience < 1:
-            counter += round(trip_time * tariff_min*2, 2)
-        else:
-            counter += round(trip_time * tariff_min/experience, 2)
-    elif tariff == 'hour':
-        if experience < 1:
-            counter += round(trip_time * tariff_hours*2, 2)
-        else:
-            counter += round(trip_time / 10 * tariff_hours/experience, 2)
-    
-    # Добавляем штраф за превышение скорости
-    if speed_violations > 0:
-        speed_penalty = speed_violations * 50  # 50 единиц штрафа за каждое нарушение
-        counter += speed_penalty
-        print(f"Добавлен штраф за превышение скорости: {speed_penalty} (всего нарушений: {speed_violations})")
-    
-    # Добавляем штраф за выезд из зоны обслуживания
-    if zone_violations > 0:
-        zone_penalty = zone_violations * 100  # 100 единиц штрафа за каждый выезд из зоны
-        counter += zone_penalty
-        print(f"Добавлен штраф за выезд из зоны обслуживания: {zone_penalty} (всего нарушений: {zone_violations})")
-    
-    return counter
+# Показатели, по которым строятся рейтинг и процентили (по ним есть индексы)
+STATS_METRICS = {
+    'trips': ClientStats.trips,
+    'total_time': ClientStats.total_time,
+    'total_spend': ClientStats.total_spend,
+}
+STATS_TOP_LIMIT = int(os.getenv('STATS_TOP_LIMIT', 100))
+TRIPS_PAGE_LIMIT = int(os.getenv('TRIPS_PAGE_LIMIT', 100))
+
+
+# Миграции схемы базы (по порядку, применяются при старте сервиса)
+def add_lookup_indexes(connection):
+    create_index(connection, 'ix_client_client_name', 'client', ['client_name'], unique=True)
+
+
+def add_trip_receipts(connection):
+    add_column(connection, 'trip', 'invoice_id', 'INTEGER')
+    add_column(connection, 'trip', 'receipt', 'TEXT')
+    create_index(connection, 'ix_trip_invoice_id', 'trip', ['invoice_id'], unique=True)
+
+
+def add_client_prepayment_id(connection):
+    add_column(connection, 'client', 'prepayment_id', 'INTEGER')
+
+
+MIGRATIONS = [add_lookup_indexes, add_trip_receipts, add_client_prepayment_id]
+
+
+def migrate_database():
+    with app.app_context():
+        migrate(db.engine, db.metadata, MIGRATIONS)
+
+
+def fetch_cars_changes(version):
+    params = {'fields': 'brand,occupied_by,is_running'}
+    headers = {}
+    if version is not None:
+        params['changed_since'] = version
+        headers['If-None-Match'] = f'"{version}"'
+    response = http_client.get(f'{CARS_URL}/car/status/all', params=params, headers=headers)
+    if response.status_code == 304:
+        return None, version
+    response.raise_for_status()
+    return response.json(), int(response.headers['X-Fleet-Version'])
+
+
+# Свободные автомобили отдаются из памяти, список поддерживается событиями
+availability = AvailabilityCache(fetch_cars_changes)
 
 
 # List all avaible cars
 @app.route('/cars', methods=['GET'])
 def get_all_cars():
-    response = requests.get(f'{CARS_URL}/car/status/all')
-    if response.status_code == 200:
-        cars = response.json()
-        avaible_cars = [car['brand'] for car in cars if car['occupied_by'] is None]
-        return jsonify(avaible_cars)
-    else:
+    body, age = availability.snapshot()
+    if age is None:
         return jsonify([])
+    return Response(body, mimetype='application/json', headers={
+        'X-Cache-Age': f'{age:.3f}', 'X-Fleet-Version': str(availability.version)})
 
 
 # List all avaible tariff
 @app.route('/tariff', methods=['GET'])
 def get_tariff():
-    return jsonify(TARIFF)
+    return Response(tariffs.table.body, mimetype='application/json')
 
 
-# Handler for telemtry car
-@app.route('/telemetry/<string:brand>', methods=['POST'])
-def telemetry(brand):
-    data = request.json['status']
+# Full compiled tariff table: rates, penalties and feature surcharges
+@app.route('/tariff/table', methods=['GET'])
+def get_tariff_table():
+    return Response(tariffs.table.definition_body, mimetype='application/json')
+
+
+# Reload tariff table from file without restart
+@app.route('/tariff/reload', methods=['POST'])
+def reload_tariff():
+    if not tariffs.reload():
+        return jsonify({'error': 'Invalid tariff file, previous table is kept'}), 400
+    return jsonify({'tariffs': tariffs.table.names, 'version': tariffs.table.version})
+
+
+# ts - время точки по часам сервиса автомобилей; без него берётся время приёма
+def process_telemetry(brand, data, keyframe=True, ts=None):
+    telemetry_store.append(brand, data, ts)
+    violation_aggregator.observe(brand, data, keyframe, ts)
+    fleet_stream.publish(brand, data)
+    is_in_service_zone = data.get('is_in_service_zone', True)
+    if is_in_service_zone:
+        return
+    # В журнал выводим только автомобили вне зоны обслуживания, остальное - в хранилище телеметрии
     speed = data.get('speed')
     coordinates = data.get('coordinates')
     speed_violations = data.get('speed_violations', 0)
     zone_violations = data.get('zone_violations', 0)
-    is_in_service_zone = data.get('is_in_service_zone', True)
-    status_text = f'"{brand} Скорость: {speed:.2f} км/ч, Координаты: {coordinates}'
-    if not is_in_service_zone:
-        status_text += f', ВНЕ ЗОНЫ ОБСЛУЖИВАНИЯ!'
+    status_text = f'"{brand} Скорость: {speed:.2f} км/ч, Координаты: {coordinates}, ВНЕ ЗОНЫ ОБСЛУЖИВАНИЯ!'
     status_text += f', Нарушений скорости: {speed_violations}, Выездов из зоны: {zone_violations}"'
     print(status_text)
+
+
+# Live fleet positions as Server-Sent Events; bbox=min_x,min_y,max_x,max_y limits the area
+@app.route('/fleet/stream', methods=['GET'])
+def fleet_stream_events():
+    bbox = request.args.get('bbox')
+    if bbox is not None:
+        try:
+            bbox = tuple(float(value) for value in bbox.split(','))
+        except ValueError:
+            bbox = ()
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            return jsonify({'error': 'bbox must be min_x,min_y,max_x,max_y'}), 400
+    subscriber = fleet_stream.subscribe(bbox)
+    if subscriber is None:
+        return jsonify({'error': 'Too many subscribers'}), 503
+    return Response(fleet_stream.events(subscriber), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/fleet/stream/stats', methods=['GET'])
+def fleet_stream_stats():
+    return jsonify(fleet_stream.stats())
+
+
+# Handler for telemtry car
+@app.route('/telemetry/<string:brand>', methods=['POST'])
+def telemetry(brand):
+    process_telemetry(brand, request.json['status'])
     return jsonify(None)
 
 
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def telemetry_message_error(message):
+    if not isinstance(message, dict):
+        return 'Message must be an object'
+    if not isinstance(message.get('brand'), str) or not message['brand']:
+        return 'Brand is required'
+    if message.get('kind', 'key') not in ('key', 'delta'):
+        return 'Kind must be key or delta'
+    if 'ts' in message and not is_number(message['ts']):
+        return 'Timestamp must be a number'
+    if 'speed' in message and not is_number(message['speed']):
+        return 'Speed must be a number'
+    coordinates = message.get('coordinates')
+    if 'coordinates' in message and not (isinstance(coordinates, list) and len(coordinates) == 2
+                                         and all(is_number(value) for value in coordinates)):
+        return 'Coordinates must be a pair of numbers'
+    return None
+
+
+# Handler for batch telemetry from cars service (key frames and deltas)
+@app.route('/telemetry/batch', methods=['POST'])
+def telemetry_batch():
+    statuses = request.json.get('statuses')
+    if not isinstance(statuses, list):
+        return jsonify({'error': 'List of statuses is required'}), 400
+    accepted = 0
+    resync = set()
+    rejected = []
+    for index, message in enumerate(statuses):
+        # Ошибочное сообщение пропускается, остальные сообщения пакета обрабатываются
+        error = telemetry_message_error(message)
+        if error is not None:
+            rejected.append({'index': index, 'error': error})
+            continue
+        status = telemetry_decoder.apply(message)
+        if status is None:
+            resync.add(message['brand'])
+            violation_aggregator.mark_incomplete(message['brand'])
+            continue
+        process_telemetry(message['brand'], status, message.get('kind', 'key') == 'key', message.get('ts'))
+        accepted += 1
+    return jsonify({'accepted': accepted, 'resync': sorted(resync), 'rejected': rejected})
+
+
+# Track of car between two timestamps (unix time, seconds)
+@app.route('/telemetry/<string:brand>/track', methods=['GET'])
+def telemetry_track(brand):
+    end = request.args.get('to', time.time(), type=float)
+    start = request.args.get('from', end - 3600, type=float)
+    limit = request.args.get('limit', type=int)
+    return jsonify(telemetry_store.track(brand, start, end, limit))
+
+
+# Violations of current trip computed from telemetry
+@app.route('/violations/<string:brand>', methods=['GET'])
+def get_violations(brand):
+    totals = violation_aggregator.totals(brand)
+    if totals is None:
+        return jsonify({'error': 'No telemetry for this car'}), 404
+    return jsonify(totals)
+
+
+@app.route('/telemetry/stats', methods=['GET'])
+def telemetry_stats():
+    return jsonify(telemetry_store.stats())
+
+
+# Batch pricing of trips and prepayments in one vectorized pass
+@app.route('/billing/batch', methods=['POST'])
+def billing_batch():
+    data = request.json
+    # Весь пакет считается по одной версии таблицы тарифов
+    table = tariffs.table
+    result = {}
+    try:
+        if 'trips' in data:
+            columns = batch_columns(data['trips'], TRIP_FIELDS)
+            result['payments'] = batch_payment(*columns, table).tolist()
+        if 'cars' in data:
+            columns = batch_columns(data['cars'], table.features)
+            result['prepayments'] = batch_prepayment(columns, table).tolist()
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid batch: {e}'}), 400
+    return jsonify(result)
+
+
 # Handler for access car
 @app.route('/access/<string:name>', methods=['POST'])
 def access(name):
     client = Client.query.filter_by(client_name=name).one_or_none()
     if client:
+        if client.prepayment_status != 'paid' and client.prepayment_id:
+            # Подтверждение предоплаты приходит из очереди сообщений и могло ещё не дойти:
+            # статус предоплаты уточняется в системе оплаты
+            response = http_client.get(f'{PAYMENT_URL}/prepayment/{client.prepayment_id}')
+            if response.status_code == 200 and response.json()['status'] == 'paid':
+                apply_prepayment_confirmed(client, response.json())
         if client.prepayment_status == 'paid':
             print(f"Доступ разрешен {name}")
+            availability.mark_busy(client.car)
             return jsonify({'access': True, 'tariff': client.tariff, 'car': client.car})
         else:
             print(f"Доступ запрещён {name}")
@@ -131,15 +336,51 @@ def access(name):
         return jsonify({'access': False}), 404
 
 
+def apply_prepayment_confirmed(client, data):
+    client.prepayment_status = data['status']
+    db.session.commit()
+    print(f'Потверждена предоплата: {data}')
+    return data
+
+
+# Завершение поездки по подтверждённой оплате. Повторное подтверждение
+# того же счёта возвращает уже сформированный чек.
+def apply_payment_confirmed(client, data, receipt):
+    trip = Trip.query.filter_by(invoice_id=data['id']).one_or_none()
+    if trip is not None:
+        return json.loads(trip.receipt)
+    final_amount = receipt['amount'] + client.prepayment
+    created_at = receipt['created_at']
+    final_receipt = {
+        'car': client.car,
+        'name': client.client_name,
+        'final_amount': final_amount,
+        'created_at': created_at,
+        'elapsed_time': client.elapsed_time,
+        'tarif': client.tariff,
+        'speed_violations': client.speed_violations,
+        'zone_violations': client.zone_violations
+    }
+    record_trip(client, final_amount, data['id'], final_receipt)
+    client.car = ''
+    client.prepayment = ''
+    client.prepayment_id = None
+    client.prepayment_status = ''
+    client.tariff = ''
+    client.elapsed_time = 0
+    client.speed_violations = 0
+    client.zone_violations = 0
+    db.session.commit()
+    print(f'Финальный чек: {final_receipt}')
+    return final_receipt
+
+
 # Handler for payment system
 @app.route('/confirm_prepayment/<string:name>', methods=['POST'])
 def confirm_prepayment(name):
     client = Client.query.filter_by(client_name=name).one_or_none()
     if client:
-        client.prepayment_status = request.json['status']
-        db.session.commit()
-        print(f'Потверждена предоплата: {request.json}')
-        return jsonify(request.json)
+        return jsonify(apply_prepayment_confirmed(client, request.json))
 
 
 # Handler for payment system
@@ -148,87 +389,270 @@ def confirm_payment(name):
     client = Client.query.filter_by(client_name=name).one_or_none()
     if client:
         print(f'Потверждена оплата: {request.json}')
-        response = requests.get(f'{PAYMENT_URL}/invoices/{request.json["id"]}/receipt')
-        if response.status_code == 200:
+        receipt = request.json.get('receipt')
+        if receipt is None:
+            response = http_client.get(f'{PAYMENT_URL}/invoices/{request.json["id"]}/receipt')
+            if response.status_code != 200:
+                return jsonify({'error': 'Receipt not found'}), 404
             receipt = response.json()['receipt']
-            final_amount = receipt['amount'] + client.prepayment
-            created_at = receipt['created_at']
-            final_receipt = {
-                'car': client.car,
-                'name': client.client_name,
-                'final_amount': final_amount,
-                'created_at': created_at,
-                'elapsed_time': client.elapsed_time,
-                'tarif': client.tariff,
-                'speed_violations': client.speed_violations,
-                'zone_violations': client.zone_violations
-            }
-            client.car = ''
-            client.prepayment = ''
-            client.prepayment_status = ''
-            client.tariff = ''
-            client.elapsed_time = 0
-            client.speed_violations = 0
-            client.zone_violations = 0
-            db.session.commit()
-        print(f'Финальный чек: {final_receipt}')
-        return jsonify(final_receipt)
+        return jsonify(apply_payment_confirmed(client, request.json, receipt))
+
+
+EVENT_HANDLERS = {
+    'prepayment_confirmed': apply_prepayment_confirmed,
+    'payment_confirmed': lambda client, data: apply_payment_confirmed(client, data, data['receipt']),
+}
+
+
+# Batch of events from payment system outbox. Events are applied in order;
+# after a failed event the following events of the same client are not applied.
+@app.route('/events/batch', methods=['POST'])
+def events_batch():
+    events = request.json.get('events')
+    if not isinstance(events, list):
+        return jsonify({'error': 'List of events is required'}), 400
+    results = []
+    blocked = set()
+    for event in events:
+        name = event.get('name')
+        ok = False
+        if name not in blocked:
+            handler = EVENT_HANDLERS.get(event.get('topic'))
+            try:
+                client = Client.query.filter_by(client_name=name).one_or_none()
+                if handler is None or client is None:
+                    print(f'Сообщение не обработано: {event}')
+                else:
+                    handler(client, event['data'])
+                    ok = True
+            except (KeyError, TypeError, ValueError, SQLAlchemyError) as e:
+                # Ошибка базы откатывает только это сообщение, остальные сообщения пакета обрабатываются
+                db.session.rollback()
+                print(f'Ошибка обработки сообщения {event.get("id")}: {e}')
+        if not ok:
+            blocked.add(name)
+        results.append({'id': event.get('id'), 'ok': ok})
+    return jsonify({'results': results})
+
+
+# Final receipt of a trip by payment system invoice id
+@app.route('/receipts/<int:invoice_id>', methods=['GET'])
+def get_receipt(invoice_id):
+    trip = Trip.query.filter_by(invoice_id=invoice_id).one_or_none()
+    if trip is None:
+        return jsonify({'error': 'Receipt not found'}), 404
+    return Response(trip.receipt, mimetype='application/json')
+
+
+# Запись поездки и обновление итогов клиента в текущей транзакции
+def record_trip(client, amount, invoice_id, receipt):
+    trip = Trip(client_id=client.id, invoice_id=invoice_id, car=client.car, tariff=client.tariff,
+                elapsed_time=client.elapsed_time or 0, prepayment=client.prepayment or 0, amount=amount,
+                speed_violations=client.speed_violations or 0, zone_violations=client.zone_violations or 0,
+                created_at=datetime.utcnow(), receipt=json.dumps(receipt))
+    db.session.add(trip)
+    # Итоги увеличиваются одной командой INSERT ... ON CONFLICT DO UPDATE, без чтения строки:
+    # первая поездка клиента в параллельных запросах не приводит к повторной вставке
+    stats = insert(ClientStats).values(client_id=client.id, trips=1, total_time=trip.elapsed_time,
+                                       total_spend=trip.amount, speed_violations=trip.speed_violations,
+                                       zone_violations=trip.zone_violations, last_trip_at=trip.created_at)
+    db.session.execute(stats.on_conflict_do_update(index_elements=[ClientStats.client_id], set_={
+        'trips': ClientStats.trips + stats.excluded.trips,
+        'total_time': ClientStats.total_time + stats.excluded.total_time,
+        'total_spend': ClientStats.total_spend + stats.excluded.total_spend,
+        'speed_violations': ClientStats.speed_violations + stats.excluded.speed_violations,
+        'zone_violations': ClientStats.zone_violations + stats.excluded.zone_violations,
+        'last_trip_at': stats.excluded.last_trip_at,
+    }))
+    return trip
+
+
+def trip_to_dict(trip):
+    return {
+        'id': trip.id,
+        'car': trip.car,
+        'tarif': trip.tariff,
+        'elapsed_time': trip.elapsed_time,
+        'prepayment': trip.prepayment,
+        'final_amount': trip.amount,
+        'speed_violations': trip.speed_violations,
+        'zone_violations': trip.zone_violations,
+        'created_at': trip.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+def stats_to_dict(stats):
+    return {
+        'trips': stats.trips if stats else 0,
+        'total_time': stats.total_time if stats else 0,
+        'total_spend': stats.total_spend if stats else 0,
+        'speed_violations': stats.speed_violations if stats else 0,
+        'zone_violations': stats.zone_violations if stats else 0,
+        'last_trip_at': stats.last_trip_at.strftime('%Y-%m-%d %H:%M:%S') if stats and stats.last_trip_at else None
+    }
+
+
+# Client trip history, newest first; before_id returns the next page
+@app.route('/clients/<string:name>/trips', methods=['GET'])
+def client_trips(name):
+    client = Client.query.filter_by(client_name=name).one_or_none()
+    if not client:
+        return jsonify({'error': 'Client not found'}), 404
+    limit = min(request.args.get('limit', TRIPS_PAGE_LIMIT, type=int), TRIPS_PAGE_LIMIT)
+    query = Trip.query.filter_by(client_id=client.id)
+    before_id = request.args.get('before_id', type=int)
+    if before_id is not None:
+        query = query.filter(Trip.id < before_id)
+    trips = query.order_by(Trip.id.desc()).limit(limit).all()
+    return jsonify({
+        'name': client.client_name,
+        'stats': stats_to_dict(db.session.get(ClientStats, client.id)),
+        'trips': [trip_to_dict(trip) for trip in trips]
+    })
+
+
+# Client totals over all trips
+@app.route('/clients/<string:name>/stats', methods=['GET'])
+def client_stats(name):
+    client = Client.query.filter_by(client_name=name).one_or_none()
+    if not client:
+        return jsonify({'error': 'Client not found'}), 404
+    return jsonify(dict(stats_to_dict(db.session.get(ClientStats, client.id)), name=client.client_name))
+
+
+# Top clients by one of the aggregated metrics
+@app.route('/stats/top', methods=['GET'])
+def stats_top():
+    metric = STATS_METRICS.get(request.args.get('by', 'total_spend'))
+    if metric is None:
+        return jsonify({'error': f'Unknown metric, expected one of {list(STATS_METRICS)}'}), 400
+    limit = min(request.args.get('n', 10, type=int), STATS_TOP_LIMIT)
+    rows = db.session.query(Client.client_name, ClientStats).join(Client, Client.id == ClientStats.client_id) \
+        .order_by(metric.desc()).limit(limit).all()
+    return jsonify([dict(stats_to_dict(stats), name=name) for name, stats in rows])
+
+
+# Percentiles of an aggregated metric across clients (nearest rank, walks the metric index)
+@app.route('/stats/percentiles', methods=['GET'])
+def stats_percentiles():
+    name = request.args.get('by', 'total_spend')
+    metric = STATS_METRICS.get(name)
+    if metric is None:
+        return jsonify({'error': f'Unknown metric, expected one of {list(STATS_METRICS)}'}), 400
+    try:
+        percentiles = [float(p) for p in request.args.get('p', '50,90,99').split(',')]
+    except ValueError:
+        return jsonify({'error': 'Percentiles must be numbers'}), 400
+    if any(not 0 < p <= 100 for p in percentiles):
+        return jsonify({'error': 'Percentiles must be in (0, 100]'}), 400
+    count = db.session.query(db.func.count()).select_from(ClientStats).scalar()
+    ranks = {p: max(math.ceil(p / 100 * count), 1) for p in percentiles}
+    values = {}
+    if count:
+        # Все процентили за один упорядоченный проход по индексу показателя
+        ordered = db.session.query(metric.label('value'),
+                                   db.func.row_number().over(order_by=metric).label('rank')).subquery()
+        values = dict(db.session.query(ordered.c.rank, ordered.c.value)
+                      .filter(ordered.c.rank.in_(set(ranks.values()))).all())
+    result = {f'{p:g}': values.get(rank) for p, rank in ranks.items()}
+    return jsonify({'by': name, 'clients': count, 'percentiles': result})
 
 
 # Select car and prepayment calculation
 @app.route('/select/car/<string:brand>', methods=['POST'])
 def select_car(brand):
-    data = request.json
-    name = data.get('client_name')
-    experience = data.get('experience')
-    tariff = data.get('tariff')
-    response = requests.post(f'{PAYMENT_URL}/clients', json={'name': name})
-    if response.status_code == 201 or 200:
-        client = Client.query.filter_by(client_name=name).one_or_none()
-        if client is None:
-            client = Client(client_name=name, experience=experience)
-            db.session.add(client)
+    with fanout.timed('select_car'):
+        data = request.json
+        name = data.get('client_name')
+        experience = data.get('experience')
+        tariff = data.get('tariff')
+        # Клиент в системе оплаты и статус автомобиля не зависят друг от друга, запрашиваем одновременно
+        client_future = fanout.submit('payment.clients', http_client.post, f'{PAYMENT_URL}/clients', json={'name': name})
+        car_future = fanout.submit('cars.status', http_client.get, f'{CARS_URL}/car/status/{brand}')
+        response = client_future.result()
+        if response.status_code == 201 or 200:
+            client = Client.query.filter_by(client_name=name).one_or_none()
+            if client is None:
+                client = Client(client_name=name, experience=experience)
+                db.session.add(client)
+                db.session.commit()
+            client.car = brand
+            client.tariff = tariff
+            car = car_future.result().json()
+            amount = counter_prepayment(car, tariffs.table)
+            client.prepayment = amount
             db.session.commit()
-        client.car = brand
-        client.tariff = tariff
-        car = requests.get(f'{CARS_URL}/car/status/{client.car}').json()
-        amount = counter_prepayment(car)
-        client.prepayment = amount
-        db.session.commit()
-        print(f'Сформирована предоплата: {client.prepayment}')
-        response = requests.post(f'{PAYMENT_URL}/clients/{response.json()[0]["id"]}/prepayment', json={'amount': client.prepayment})
-
-        return jsonify(response.json())
-    else:
-        print("Ошибка при создании клиента:", response.json())
-        return None
+            print(f'Сформирована предоплата: {client.prepayment}')
+            response = fanout.call('payment.prepayment', http_client.post,
+                                   f'{PAYMENT_URL}/clients/{response.json()[0]["id"]}/prepayment',
+                                   json={'amount': client.prepayment})
+            if response.status_code == 201:
+                client.prepayment_id = response.json()['id']
+                db.session.commit()
+
+            return jsonify(response.json())
+        else:
+            print("Ошибка при создании клиента:", response.json())
+            return None
 
 
 # Handler for return car
 @app.route('/return/<string:name>', methods=['POST'])
 def return_car(name):
-    client = Client.query.filter_by(client_name=name).one_or_none()
-    if client:
-        data = request.json
-        trip_time = data.get('status')['trip_time']
-        speed_violations = data.get('status')['speed_violations']
-        zone_violations = data.get('status')['zone_violations']
-        client.elapsed_time = trip_time
-        client.speed_violations = speed_violations
-        client.zone_violations = zone_violations
-        db.session.commit()
-        amount = counter_payment(trip_time, client.tariff, client.experience, speed_violations, zone_violations)
-        response = requests.post(f'{PAYMENT_URL}/clients', json={'name': name})
-        if response.status_code == 201 or 200:
-            response = requests.post(f'{PAYMENT_URL}/invoices', json={'client_id': response.json()[0]['id'], 'amount': amount})
-            invoice = response.json()
-            return jsonify(invoice)
+    with fanout.timed('return_car'):
+        client = Client.query.filter_by(client_name=name).one_or_none()
+        if client:
+            # Клиент в системе оплаты запрашивается, пока считаются нарушения и стоимость поездки
+            client_future = fanout.submit('payment.clients', http_client.post, f'{PAYMENT_URL}/clients',
+                                          json={'name': name})
+            data = request.json
+            trip_time = data.get('status')['trip_time']
+            # Нарушения берём из собственного подсчёта по телеметрии поездки (ts - время остановки автомобиля)
+            violations = violation_aggregator.finish(client.car, data.get('ts'))
+            reported = data.get('status')
+            if violations is None:
+                print(f"Нет телеметрии поездки {client.car}, используются нарушения из статуса автомобиля")
+                violations = reported
+            elif not violations['complete'] or data.get('seq') not in (None, telemetry_decoder.last_seq(client.car)):
+                # Часть телеметрии потеряна (пропуск внутри поездки или не дошедшие последние пакеты):
+                # подсчёт по ней может быть занижен, берём большее из посчитанного и итогов автомобиля
+                print(f"Телеметрия поездки {client.car} неполная, учитываются итоги автомобиля")
+                violations = {field: max(violations[field], reported[field])
+                              for field in ('speed_violations', 'zone_violations')}
+            print(f"Нарушения поездки {client.car}: {violations}")
+            speed_violations = violations['speed_violations']
+            zone_violations = violations['zone_violations']
+            client.elapsed_time = trip_time
+            client.speed_violations = speed_violations
+            client.zone_violations = zone_violations
+            db.session.commit()
+            availability.mark_free(client.car)
+            amount = counter_payment(trip_time, client.tariff, client.experience, speed_violations, zone_violations,
+                                     tariffs.table)
+            response = client_future.result()
+            if response.status_code == 201 or 200:
+                response = fanout.call('payment.invoices', http_client.post, f'{PAYMENT_URL}/invoices',
+                                       json={'client_id': response.json()[0]['id'], 'amount': amount})
+                invoice = response.json()
+                return jsonify(invoice)
+            else:
+                print('Нет связи с банком')
+            return jsonify({'error': True}), 404
         else:
-            print('Нет связи с банком')
-        return jsonify({'error': True}), 404
-    else:
-        print(f"Такой клиент{name} не арендовал машину.")
-        return jsonify({'error': True}), 404
+            print(f"Такой клиент{name} не арендовал машину.")
+            return jsonify({'error': True}), 404
+
+
+# Статистика вызовов других сервисов
+@app.route('/http/stats', methods=['GET'])
+def get_http_stats():
+    return jsonify(http_client.stats())
+
+
+# Время шагов обработчиков: отдельные вызовы и обработчик целиком
+@app.route('/http/hops', methods=['GET'])
+def get_http_hops():
+    return jsonify(fanout.stats())
 
 
 @app.errorhandler(HTTPException)
@@ -241,6 +665,10 @@ def handle_exception(e):
 
 
 def start_web():
+    migrate_database()
+    os.makedirs(app.instance_path, exist_ok=True)
+    telemetry_store.open()
+    tariffs.watch()
     threading.Thread(target=lambda: app.run(
         host=HOST, port=PORT, debug=True, use_reloader=False
     )).start()
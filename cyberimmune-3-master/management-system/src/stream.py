@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+
+# Период рассылки обновлений подписчикам в секундах
+FLEET_STREAM_INTERVAL = float(os.getenv('FLEET_STREAM_INTERVAL', 0.5))
+# Сколько автомобилей может ждать отправки одному подписчику, лишние (самые старые) отбрасываются
+FLEET_STREAM_QUEUE_SIZE = int(os.getenv('FLEET_STREAM_QUEUE_SIZE', 10000))
+# Максимальное число одновременных подписчиков
+FLEET_STREAM_MAX_SUBSCRIBERS = int(os.getenv('FLEET_STREAM_MAX_SUBSCRIBERS', 100))
+# Период служебных сообщений, по которым обнаруживаются отключившиеся подписчики
+FLEET_STREAM_KEEPALIVE = float(os.getenv('FLEET_STREAM_KEEPALIVE', 15))
+
+# Поля статуса, которые попадают в поток
+STREAM_FIELDS = ('coordinates', 'speed', 'is_running', 'is_in_service_zone', 'occupied_by')
+
+
+class Subscriber:
+    def __init__(self, bbox, queue_size):
+        self.bbox = bbox
+        self.queue_size = queue_size
+        self.dropped = 0
+        # Очередь с заменой: для каждого автомобиля хранится только последнее сообщение
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def accepts(self, coordinates):
+        if self.bbox is None:
+            return True
+        if not coordinates:
+            return False
+        min_x, min_y, max_x, max_y = self.bbox
+        return min_x <= coordinates[0] <= max_x and min_y <= coordinates[1] <= max_y
+
+    def put(self, messages):
+        with self._lock:
+            self._pending.update(messages)
+            overflow = len(self._pending) - self.queue_size
+            if overflow > 0:
+                for brand in list(self._pending)[:overflow]:
+                    del self._pending[brand]
+                self.dropped += overflow
+        self._ready.set()
+
+    def take(self, timeout):
+        self._ready.wait(timeout)
+        self._ready.clear()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+
+# Поток положений автопарка для подписчиков (Server-Sent Events).
+# Обработчики телеметрии только запоминают последний статус автомобиля,
+# один поток-производитель раз в интервал сериализует каждое обновление
+# один раз и раскладывает готовые сообщения по очередям подписчиков.
+class FleetStream:
+    def __init__(self, interval=FLEET_STREAM_INTERVAL, queue_size=FLEET_STREAM_QUEUE_SIZE,
+                 max_subscribers=FLEET_STREAM_MAX_SUBSCRIBERS, keepalive=FLEET_STREAM_KEEPALIVE):
+        self.interval = interval
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.keepalive = keepalive
+        self.published = 0
+        self._staged = {}
+        self._latest = {}
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def publish(self, brand, status):
+        with self._lock:
+            self._staged[brand] = status
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='fleet-stream', daemon=True)
+                self._thread.start()
+
+    def _encode(self, brand, status, ts):
+        event = {field: status.get(field) for field in STREAM_FIELDS}
+        event['brand'] = brand
+        event['ts'] = ts
+        return f'event: car\ndata: {json.dumps(event)}\n\n'
+
+    def flush(self):
+        with self._lock:
+            staged, self._staged = self._staged, {}
+        if not staged:
+            return 0
+        ts = time.time()
+        updates = [(brand, status.get('coordinates'), self._encode(brand, status, ts))
+                   for brand, status in staged.items()]
+        with self._lock:
+            for brand, coordinates, message in updates:
+                self._latest[brand] = (coordinates, message)
+            subscribers = list(self._subscribers)
+        everything = [(brand, message) for brand, _, message in updates]
+        for subscriber in subscribers:
+            if subscriber.bbox is None:
+                subscriber.put(everything)
+            else:
+                subscriber.put([(brand, message) for brand, coordinates, message in updates
+                                if subscriber.accepts(coordinates)])
+        self.published += len(updates)
+        return len(updates)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    # Новый подписчик сразу получает последние известные положения автомобилей
+    def subscribe(self, bbox=None):
+        subscriber = Subscriber(bbox, self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(subscriber)
+            snapshot = [(brand, message) for brand, (coordinates, message) in self._latest.items()
+                        if subscriber.accepts(coordinates)]
+        subscriber.put(snapshot)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    # Генератор тела ответа text/event-stream для подписчика
+    def events(self, subscriber):
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                messages = subscriber.take(self.keepalive)
+                if messages:
+                    yield ''.join(messages)
+                else:
+                    yield ': keepalive\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            cars = len(self._latest)
+        return {'subscribers': len(subscribers), 'cars': cars, 'published': self.published,
+                'dropped': sum(subscriber.dropped for subscriber in subscribers)}
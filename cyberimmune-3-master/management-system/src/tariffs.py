@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import time
+
+# Период проверки файла тарифов на изменения в секундах
+TARIFF_RELOAD_INTERVAL = float(os.getenv('TARIFF_RELOAD_INTERVAL', 5))
+# Функции автомобиля, за которые может назначаться надбавка (поля статуса автомобиля)
+CAR_FEATURES = ('has_air_conditioner', 'has_heater', 'has_navigator')
+
+
+def is_price(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+class Tariff:
+    __slots__ = ('name', 'rate', 'time_unit', 'novice_time_unit', 'novice_multiplier')
+
+    def __init__(self, name, rate, time_unit=1, novice_time_unit=1, novice_multiplier=1):
+        for value in (rate, time_unit, novice_time_unit, novice_multiplier):
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+                raise ValueError(f'Некорректные параметры тарифа {name}')
+        self.name = name
+        self.rate = rate
+        self.time_unit = time_unit
+        self.novice_time_unit = novice_time_unit
+        self.novice_multiplier = novice_multiplier
+
+
+# Скомпилированная таблица тарифов. После создания не меняется:
+# при перезагрузке создаётся новая таблица и подменяется целиком.
+# Файл с неверными типами или неизвестными функциями отклоняется целиком, чтобы ошибка
+# не проявилась позже при расчёте цены.
+class TariffTable:
+    def __init__(self, definition, version):
+        self.version = version
+        self.novice_experience = definition.get('novice_experience', 1)
+        if not is_price(self.novice_experience):
+            raise ValueError('Некорректный опыт новичка')
+        self.tariffs = {name: Tariff(name, **params) for name, params in definition['tariffs'].items()}
+        if not self.tariffs:
+            raise ValueError('Не задано ни одного тарифа')
+        self.speed_penalty = definition['penalties']['speed_violation']
+        self.zone_penalty = definition['penalties']['zone_violation']
+        if not is_price(self.speed_penalty) or not is_price(self.zone_penalty):
+            raise ValueError('Штрафы должны быть неотрицательными числами')
+        self.features = dict(definition['features'])
+        unknown = set(self.features) - set(CAR_FEATURES)
+        if unknown:
+            raise ValueError(f'Неизвестные функции автомобиля: {sorted(unknown)}')
+        if not all(is_price(price) for price in self.features.values()):
+            raise ValueError('Надбавки за функции должны быть неотрицательными числами')
+        self.names = list(self.tariffs)
+        # Готовые ответы для /tariff и /tariff/table
+        self.body = json.dumps(self.names)
+        self.definition_body = json.dumps(dict(definition, version=version), ensure_ascii=False)
+
+
+def load_tariff_table(path):
+    with open(path, 'r') as file:
+        definition = json.load(file)
+    try:
+        return TariffTable(definition, os.path.getmtime(path))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f'Некорректный файл тарифов: {e}')
+
+
+# Актуальная таблица тарифов с горячей перезагрузкой из файла.
+# Расчёт цен читает только ссылку table, без блокировок.
+class TariffBook:
+    def __init__(self, path, reload_interval=TARIFF_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.table = load_tariff_table(path)
+        # Время изменения файла при последней попытке загрузки, чтобы не перечитывать ошибочный файл
+        self._checked = self.table.version
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def reload(self):
+        with self._lock:
+            try:
+                self._checked = os.path.getmtime(self.path)
+                table = load_tariff_table(self.path)
+            except (OSError, ValueError) as e:
+                print(f'Тарифы не перезагружены, используется прежняя таблица: {e}')
+                return False
+            self.table = table
+            print(f'Загружены тарифы: {table.names}')
+            return True
+
+    def watch(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='tariff-watcher', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                changed = os.path.getmtime(self.path) != self._checked
+            except OSError:
+                continue
+            if changed:
+                self.reload()
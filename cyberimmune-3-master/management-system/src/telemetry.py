@@ -0,0 +1,42 @@
+import threading
+
+# Служебные поля сообщений телеметрии, которые не входят в статус автомобиля
+MESSAGE_FIELDS = ('kind', 'seq', 'ts')
+
+
+# Восстановление полного статуса автомобиля из ключевых кадров и дельт телеметрии
+class TelemetryDecoder:
+    def __init__(self):
+        self.states = {}
+        self._seq = {}
+        self._lock = threading.Lock()
+
+    # Возвращает полный статус или None, если состояние потеряно и нужен ключевой кадр
+    def apply(self, message):
+        brand = message['brand']
+        seq = message.get('seq')
+        fields = {field: value for field, value in message.items() if field not in MESSAGE_FIELDS}
+        with self._lock:
+            if message.get('kind', 'key') == 'key':
+                state = fields
+                self.states[brand] = state
+            else:
+                state = self.states.get(brand)
+                last_seq = self._seq.get(brand)
+                if state is None or (seq is not None and last_seq is not None and seq != last_seq + 1):
+                    # Пропущено сообщение: дельты применять нельзя до следующего ключевого кадра
+                    self.states.pop(brand, None)
+                    return None
+                state.update(fields)
+            self._seq[brand] = seq
+            return dict(state)
+
+    # Номер последнего применённого сообщения автомобиля
+    def last_seq(self, brand):
+        with self._lock:
+            return self._seq.get(brand)
+
+    def get(self, brand):
+        with self._lock:
+            state = self.states.get(brand)
+            return dict(state) if state is not None else None
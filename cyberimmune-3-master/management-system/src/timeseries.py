@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# Сколько последних точек телеметрии одного автомобиля держим в памяти до записи на диск
+TELEMETRY_BUFFER_SIZE = int(os.getenv('TELEMETRY_BUFFER_SIZE', 600))
+# Период фоновой записи телеметрии в базу в секундах
+TELEMETRY_WRITE_INTERVAL = float(os.getenv('TELEMETRY_WRITE_INTERVAL', 2))
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS car ('
+    ' id INTEGER PRIMARY KEY,'
+    ' brand TEXT NOT NULL UNIQUE)',
+    # Таблица без rowid с ключом (car_id, ts): точки одного автомобиля лежат рядом и упорядочены по времени
+    'CREATE TABLE IF NOT EXISTS telemetry ('
+    ' car_id INTEGER NOT NULL,'
+    ' ts REAL NOT NULL,'
+    ' x REAL,'
+    ' y REAL,'
+    ' speed REAL,'
+    ' in_zone INTEGER,'
+    ' PRIMARY KEY (car_id, ts)) WITHOUT ROWID',
+)
+
+
+def sample_to_dict(sample):
+    ts, x, y, speed, in_zone = sample
+    return {'ts': ts, 'coordinates': [x, y], 'speed': speed, 'is_in_service_zone': bool(in_zone)}
+
+
+# Хранилище временных рядов телеметрии: точки копятся в кольцевых буферах
+# по автомобилям, фоновый поток пакетно пишет их в SQLite одной транзакцией.
+# Приём телеметрии никогда не ждёт диск: при отставании записи старые точки вытесняются.
+class TelemetryStore:
+    def __init__(self, path, buffer_size=TELEMETRY_BUFFER_SIZE, write_interval=TELEMETRY_WRITE_INTERVAL):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.write_interval = write_interval
+        self.written = 0
+        self.dropped = 0
+        self._buffers = {}
+        self._car_ids = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    # Создание таблиц и запуск фоновой записи, вызывается при старте сервиса.
+    # До открытия точки только копятся в буферах.
+    def open(self):
+        connection = self._connect()
+        try:
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+            self._car_ids.update(connection.execute('SELECT brand, id FROM car'))
+        finally:
+            connection.close()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='telemetry-writer', daemon=True)
+                self._thread.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, brand, status, ts=None):
+        coordinates = status.get('coordinates') or (None, None)
+        sample = (time.time() if ts is None else ts, coordinates[0], coordinates[1],
+                  status.get('speed'), int(status.get('is_in_service_zone', True)))
+        with self._lock:
+            buffer = self._buffers.get(brand)
+            if buffer is None:
+                buffer = self._buffers[brand] = deque(maxlen=self.buffer_size)
+            if len(buffer) == self.buffer_size:
+                self.dropped += 1
+            buffer.append(sample)
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._buffers = self._buffers, {}
+        return pending
+
+    # Точки, которые не удалось записать, возвращаются в начало буферов;
+    # не поместившиеся в буфер старые точки считаются потерянными
+    def _restore_pending(self, pending):
+        with self._lock:
+            for brand, samples in pending.items():
+                buffer = deque(samples, maxlen=self.buffer_size)
+                overflow = max(len(samples) + len(self._buffers.get(brand, ())) - self.buffer_size, 0)
+                buffer.extend(self._buffers.get(brand, ()))
+                self._buffers[brand] = buffer
+                self.dropped += overflow
+
+    # Новые ИД автомобилей попадают в кэш только после фиксации транзакции
+    def _car_id(self, connection, brand, new_ids):
+        car_id = self._car_ids.get(brand) or new_ids.get(brand)
+        if car_id is None:
+            connection.execute('INSERT OR IGNORE INTO car (brand) VALUES (?)', (brand,))
+            car_id = connection.execute('SELECT id FROM car WHERE brand = ?', (brand,)).fetchone()[0]
+            new_ids[brand] = car_id
+        return car_id
+
+    # Запись накопленных точек одной транзакцией
+    def flush(self):
+        with self._write_lock:
+            pending = self._take_pending()
+            if not pending:
+                return 0
+            new_ids = {}
+            connection = self._connect()
+            try:
+                with connection:
+                    rows = []
+                    for brand, samples in pending.items():
+                        car_id = self._car_id(connection, brand, new_ids)
+                        rows.extend((car_id, *sample) for sample in samples)
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO telemetry (car_id, ts, x, y, speed, in_zone) VALUES (?, ?, ?, ?, ?, ?)',
+                        rows)
+            except sqlite3.Error:
+                # Транзакция откатилась: точки остаются в буферах до следующей записи
+                self._restore_pending(pending)
+                raise
+            finally:
+                connection.close()
+            self._car_ids.update(new_ids)
+            self.written += len(rows)
+            return len(rows)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.write_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Ошибка записи телеметрии: {e}")
+
+    # Трек автомобиля за интервал времени: записанные точки и ещё не записанные из буфера
+    def track(self, brand, start, end, limit=None):
+        samples = []
+        # Чтение ждёт только текущую запись, приём телеметрии при этом не блокируется
+        with self._write_lock:
+            car_id = self._car_ids.get(brand)
+            if car_id is not None:
+                connection = self._connect()
+                try:
+                    samples = connection.execute(
+                        'SELECT ts, x, y, speed, in_zone FROM telemetry WHERE car_id = ? AND ts BETWEEN ? AND ? '
+                        'ORDER BY ts', (car_id, start, end)).fetchall()
+                finally:
+                    connection.close()
+            with self._lock:
+                samples.extend(sample for sample in self._buffers.get(brand, ()) if start <= sample[0] <= end)
+        if limit is not None:
+            samples = samples[:limit]
+        return [sample_to_dict(sample) for sample in samples]
+
+    def stats(self):
+        with self._lock:
+            pending = sum(len(buffer) for buffer in self._buffers.values())
+        return {'pending': pending, 'written': self.written, 'dropped': self.dropped}
@@ -0,0 +1,102 @@
+import threading
+import time
+
+
+class TripViolations:
+    __slots__ = ('speeding', 'speed_episodes', 'in_zone', 'zone_exits', 'out_since', 'out_of_zone_time', 'trip_time',
+                 'last_ts', 'complete')
+
+    def __init__(self):
+        self.speeding = False
+        self.speed_episodes = 0
+        self.in_zone = True
+        self.zone_exits = 0
+        self.out_since = None
+        self.out_of_zone_time = 0.0
+        self.trip_time = None
+        self.last_ts = None
+        # Сброс, если часть телеметрии поездки потеряна
+        self.complete = True
+
+    def to_dict(self, now):
+        out_of_zone_time = self.out_of_zone_time
+        if self.out_since is not None:
+            out_of_zone_time += now - self.out_since
+        return {
+            'speed_violations': self.speed_episodes,
+            'zone_violations': self.zone_exits,
+            'out_of_zone_time': round(out_of_zone_time, 2),
+            'complete': self.complete
+        }
+
+
+# Подсчёт нарушений по потоку телеметрии: на каждый автомобиль хранится
+# только состояние текущей поездки, каждая точка обрабатывается за O(1).
+# Эпизод превышения скорости - непрерывная серия точек на ограничении и выше.
+# Время точки (now) - время такта по часам сервиса автомобилей, если оно известно.
+class ViolationAggregator:
+    def __init__(self, speed_limit):
+        self.speed_limit = speed_limit
+        self._trips = {}
+        # Время завершения последней поездки автомобиля, пока не началась следующая
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def observe(self, brand, status, keyframe=True, now=None):
+        now = time.time() if now is None else now
+        trip_time = status.get('trip_time') if keyframe else None
+        with self._lock:
+            finished_at = self._finished.get(brand)
+            if finished_at is not None:
+                # Точки завершённой поездки, дошедшие после возврата, не относятся ни к одной поездке;
+                # следующая поездка начинается с ключевого кадра
+                if not keyframe or now < finished_at:
+                    return
+                del self._finished[brand]
+                self._trips.pop(brand, None)
+            trip = self._trips.get(brand)
+            # Ключевой кадр с меньшим временем поездки означает начало новой поездки
+            if trip is None or (trip_time is not None and trip.trip_time is not None and trip_time < trip.trip_time):
+                trip = self._trips[brand] = TripViolations()
+            if trip_time is not None:
+                trip.trip_time = trip_time
+            trip.last_ts = now
+
+            speeding = (status.get('speed') or 0) >= self.speed_limit
+            if speeding and not trip.speeding:
+                trip.speed_episodes += 1
+            trip.speeding = speeding
+
+            in_zone = status.get('is_in_service_zone', True)
+            if not in_zone and trip.in_zone:
+                trip.zone_exits += 1
+                trip.out_since = now
+            elif in_zone and not trip.in_zone:
+                trip.out_of_zone_time += now - trip.out_since
+                trip.out_since = None
+            trip.in_zone = in_zone
+
+    # Часть телеметрии текущей поездки потеряна (пропуск в номерах сообщений)
+    def mark_incomplete(self, brand):
+        with self._lock:
+            if brand in self._finished:
+                return
+            trip = self._trips.get(brand)
+            if trip is None:
+                trip = self._trips[brand] = TripViolations()
+            trip.complete = False
+
+    # Итоги текущей поездки на момент последней точки
+    def totals(self, brand):
+        with self._lock:
+            trip = self._trips.get(brand)
+            return trip.to_dict(trip.last_ts) if trip else None
+
+    # Итоги поездки при возврате автомобиля (now - время остановки), состояние автомобиля сбрасывается
+    def finish(self, brand, now=None):
+        with self._lock:
+            trip = self._trips.pop(brand, None)
+            if now is None:
+                now = trip.last_ts if trip else time.time()
+            self._finished[brand] = now
+            return trip.to_dict(now) if trip else None
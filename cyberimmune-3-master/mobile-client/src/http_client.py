@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Размер пула соединений к одному сервису
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 20))
+# Таймауты установки соединения и чтения ответа в секундах
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, failed):
+        self.requests += 1
+        self.errors += failed
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'avg_ms': round(self.total_time / self.requests * 1000, 2) if self.requests else 0,
+            'max_ms': round(self.max_time * 1000, 2)
+        }
+
+
+# Клиент для вызовов между сервисами: своя сессия с пулом keep-alive
+# соединений на каждый целевой сервис, таймауты по умолчанию и статистика по хостам
+class HttpClient:
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._sessions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _target(self, url):
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'
+
+    def session(self, url):
+        target = self._target(url)
+        session = self._sessions.get(target)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(target)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount(target, adapter)
+                    self._sessions[target] = session
+                    self._stats[target] = HostStats()
+        return session
+
+    def request(self, method, url, **kwargs):
+        session = self.session(url)
+        kwargs.setdefault('timeout', self.timeout)
+        failed = True
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._stats[self._target(url)].record(elapsed, failed)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {target: stats.to_dict() for target, stats in self._stats.items()}
+
+
+client = HttpClient()
+get = client.get
+post = client.post
+stats = client.stats
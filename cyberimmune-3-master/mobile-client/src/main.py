@@ -1,4 +1,3 @@
-import requests
 import random
 import time
 import os
@@ -6,6 +5,8 @@ from flask import Flask, jsonify, request
 import threading
 from werkzeug.exceptions import HTTPException
 
+from . import http_client
+
 HOST = '0.0.0.0'
 PORT = 8000
 MODULE_NAME = os.getenv('MODULE_NAME')
@@ -14,6 +15,9 @@ app = Flask(__name__)
 MANAGMENT_URL = 'http://management_system:8000'
 PAYMENT_URL = 'http://payment_system:8000'
 CARS_URL = 'http://cars:8000'
+# Сколько секунд ждать финальный чек после подтверждения оплаты
+RECEIPT_WAIT = float(os.getenv('RECEIPT_WAIT', 10))
+RECEIPT_POLL_INTERVAL = float(os.getenv('RECEIPT_POLL_INTERVAL', 0.2))
 
 
 # Выбор и запрос авто (автоматически выбирает из свободных машин и выбирает тариф)
@@ -74,14 +78,17 @@ def prepayment():
 def final_pay():
     data = request.json
     invoice_id = data.get('invoice_id')
-    final_receipt = confirm_payment(invoice_id)
+    payment = confirm_payment(invoice_id)
+    if payment.status_code != 200:
+        return jsonify(payment.json()), 404
+    final_receipt = get_final_receipt(invoice_id)
     if final_receipt.status_code == 200:
-        return jsonify(final_receipt.json()['final_receipt'])
+        return jsonify(final_receipt.json())
     else:
         return jsonify(final_receipt.json()), 404
 
 def get_car():
-    response = requests.get(f'{MANAGMENT_URL}/cars')
+    response = http_client.get(f'{MANAGMENT_URL}/cars')
     if response.status_code == 200:
         print("Информация о доступных автомобилях:", response.json())
         return response.json()
@@ -90,7 +97,7 @@ def get_car():
 
 
 def get_tariff():
-    response = requests.get(f'{MANAGMENT_URL}/tariff')
+    response = http_client.get(f'{MANAGMENT_URL}/tariff')
     if response.status_code == 200:
         print("Информация о доступных тарифах:", response.json())
         return response.json()
@@ -98,7 +105,7 @@ def get_tariff():
         print("Ошибка при получении доступных тарифов:", response.json())
 
 def select_auto_and_prepayment(name, experience, brand, tariff):
-    response = requests.post(f'{MANAGMENT_URL}/select/car/{brand}', json={'client_name': name, 'experience': experience, 'tariff': tariff})
+    response = http_client.post(f'{MANAGMENT_URL}/select/car/{brand}', json={'client_name': name, 'experience': experience, 'tariff': tariff})
     if response.status_code == 200:
         print("Информация о предоплате:", response.json())
         return response.json()
@@ -106,7 +113,7 @@ def select_auto_and_prepayment(name, experience, brand, tariff):
         print("Ошибка при получении информации о предоплате:", response.json())
 
 def confirm_prepayment(prepayment_id):
-    response = requests.post(f'{PAYMENT_URL}/prepayment/{prepayment_id}/confirm')
+    response = http_client.post(f'{PAYMENT_URL}/prepayment/{prepayment_id}/confirm')
     if response.status_code == 200:
         print("Предоплата подтверждена:", response.json())
         return response
@@ -115,17 +122,30 @@ def confirm_prepayment(prepayment_id):
         return response
 
 def confirm_payment(invoice_id: int):
-    response = requests.post(f'{PAYMENT_URL}/invoices/{invoice_id}/confirm')
+    response = http_client.post(f'{PAYMENT_URL}/invoices/{invoice_id}/confirm')
     if response.status_code == 200:
         print("Оплата потверждена:", response.json())
-        print("Финальный чек:", response.json()['final_receipt'])
         return response
     else:
         print("Ошибка при подтверждении оплаты:", response.json())
         return response
 
+# Финальный чек формируется системой управления после доставки подтверждения оплаты
+def get_final_receipt(invoice_id: int):
+    deadline = time.monotonic() + RECEIPT_WAIT
+    while True:
+        response = http_client.get(f'{MANAGMENT_URL}/receipts/{invoice_id}')
+        if response.status_code != 404 or time.monotonic() >= deadline:
+            break
+        time.sleep(RECEIPT_POLL_INTERVAL)
+    if response.status_code == 200:
+        print("Финальный чек:", response.json())
+    else:
+        print("Ошибка при получении финального чека:", response.json())
+    return response
+
 def access(name):
-    response = requests.post(f'{CARS_URL}/car/occupy/{name}')
+    response = http_client.post(f'{CARS_URL}/car/occupy/{name}')
     if response.status_code == 200:
         print(response.json()['message'])
         return response.json()
@@ -134,7 +154,7 @@ def access(name):
         return response.json()
 
 def start_travel(brand):
-    response = requests.post(f'{CARS_URL}/car/start/{brand}')
+    response = http_client.post(f'{CARS_URL}/car/start/{brand}')
     if response.status_code == 200:
         print(response.json()['message'])
         return response.json()
@@ -144,7 +164,7 @@ def start_travel(brand):
 
 
 def stop_travel(brand):
-    response = requests.post(f'{CARS_URL}/car/stop/{brand}')
+    response = http_client.post(f'{CARS_URL}/car/stop/{brand}')
     if response.status_code == 200:
         print(response.json()['message'])
         return response.json()
@@ -152,6 +172,12 @@ def stop_travel(brand):
         print(response.json()['message'])
 
 
+# Статистика вызовов других сервисов
+@app.route('/http/stats', methods=['GET'])
+def get_http_stats():
+    return jsonify(http_client.stats())
+
+
 @app.errorhandler(HTTPException)
 def handle_exception(e):
     response = e.get_response()
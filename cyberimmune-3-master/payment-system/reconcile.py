@@ -0,0 +1,13 @@
+import json
+import sys
+
+from src.main import engine, migrate_database
+from src.balances import reconcile_balances
+
+
+# Сверка балансов клиентов с таблицами счетов и предоплат: python reconcile.py [--fix]
+if __name__ == '__main__':
+    migrate_database()
+    report = reconcile_balances(engine, fix='--fix' in sys.argv[1:])
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(1 if report['drift'] and not report['fixed'] else 0)
@@ -0,0 +1,148 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+# Сколько счетов переносится в архив одной транзакцией
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 10000))
+# Период запуска архивации в секундах
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', 60))
+# Оплаченный счёт переносится в архив не раньше, чем через столько секунд после создания
+ARCHIVE_MIN_AGE = float(os.getenv('ARCHIVE_MIN_AGE', 300))
+# Период сжатия базы (VACUUM) в секундах, 0 - не сжимать
+ARCHIVE_VACUUM_INTERVAL = float(os.getenv('ARCHIVE_VACUUM_INTERVAL', 0))
+
+# Архив разбит на таблицы по месяцам создания счёта: archived_invoice_2024_05 и т.д.
+PARTITION_PREFIX = 'archived_invoice_'
+PARTITION_NAME = re.compile(r'^archived_invoice_\d{4}_\d{2}$')
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Условие переноса; одно и то же для INSERT ... SELECT и DELETE, чтобы переносились ровно удаляемые строки
+ARCHIVABLE = "status = 'PAID' AND created_at < :cutoff AND id > :low AND id <= :high"
+
+
+# Месячные таблицы архива от новых месяцев к старым
+def partition_tables(connection):
+    names = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars()
+    return sorted((name for name in names if PARTITION_NAME.match(name)), reverse=True)
+
+
+# Фоновая архивация оплаченных счетов: пакеты по диапазонам id переносятся
+# из таблицы invoice в месячные таблицы архива через INSERT ... SELECT и DELETE,
+# таблица invoice остаётся маленькой, а запросы чека только читают.
+class InvoiceArchiver:
+    def __init__(self, engine, batch_size=ARCHIVE_BATCH_SIZE, interval=ARCHIVE_INTERVAL, min_age=ARCHIVE_MIN_AGE,
+                 vacuum_interval=ARCHIVE_VACUUM_INTERVAL):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.interval = interval
+        self.min_age = min_age
+        self.vacuum_interval = vacuum_interval
+        self.archived = 0
+        self.last_run = None
+        self.last_vacuum = None
+        self._archived_since_vacuum = 0
+        self._partitions = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='invoice-archiver', daemon=True)
+            self._thread.start()
+
+    def partitions(self):
+        if self._partitions is None:
+            with self.engine.connect() as connection:
+                self._partitions = partition_tables(connection)
+        return self._partitions
+
+    def _create_partition(self, connection, table):
+        connection.exec_driver_sql(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            ' id INTEGER PRIMARY KEY,'
+            ' client_id INTEGER NOT NULL,'
+            ' amount FLOAT NOT NULL,'
+            ' status VARCHAR(7),'
+            ' created_at DATETIME)')
+        connection.exec_driver_sql(
+            f'CREATE INDEX IF NOT EXISTS ix_{table}_client_created ON {table} (client_id, created_at, id)')
+
+    # Перенос одного пакета, возвращает число перенесённых счетов
+    def _archive_batch(self, connection, cutoff, low):
+        params = {'cutoff': cutoff, 'low': low, 'high': None}
+        params['high'] = connection.execute(text(
+            "SELECT MAX(id) FROM (SELECT id FROM invoice WHERE status = 'PAID' AND created_at < :cutoff "
+            'AND id > :low ORDER BY id LIMIT :limit)'), dict(params, limit=self.batch_size)).scalar()
+        if params['high'] is None:
+            return 0, None
+        months = connection.execute(text(
+            f"SELECT DISTINCT strftime('%Y_%m', created_at) FROM invoice WHERE {ARCHIVABLE}"), params).scalars().all()
+        for month in months:
+            table = PARTITION_PREFIX + month
+            self._create_partition(connection, table)
+            connection.execute(text(
+                f'INSERT INTO {table} (id, client_id, amount, status, created_at) '
+                f'SELECT id, client_id, amount, status, created_at FROM invoice '
+                f"WHERE {ARCHIVABLE} AND strftime('%Y_%m', created_at) = :month"), dict(params, month=month))
+        moved = connection.execute(text(f'DELETE FROM invoice WHERE {ARCHIVABLE}'), params).rowcount
+        return moved, params['high']
+
+    # min_age - минимальный возраст переносимых счетов для этого запуска (по умолчанию из настроек)
+    def archive(self, min_age=None):
+        min_age = self.min_age if min_age is None else min_age
+        with self._lock:
+            cutoff = (datetime.utcnow() - timedelta(seconds=min_age)).strftime(DATETIME_FORMAT)
+            total = 0
+            low = 0
+            while True:
+                # Каждый пакет - отдельная короткая транзакция, запросы к базе между ними не ждут
+                with self.engine.begin() as connection:
+                    moved, low = self._archive_batch(connection, cutoff, low)
+                if low is None:
+                    break
+                total += moved
+            self._partitions = None
+            self.archived += total
+            self._archived_since_vacuum += total
+            self.last_run = time.time()
+            if total:
+                print(f'В архив перенесено счетов: {total}')
+            return total
+
+    def vacuum(self):
+        with self._lock:
+            with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.exec_driver_sql('VACUUM')
+            self._archived_since_vacuum = 0
+            self.last_vacuum = time.time()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.archive()
+                if self.vacuum_interval and self._archived_since_vacuum and \
+                        time.time() - (self.last_vacuum or 0) >= self.vacuum_interval:
+                    self.vacuum()
+            except SQLAlchemyError as e:
+                print(f'Ошибка архивации счетов: {e}')
+
+    # Счёт из архива по id (id счёта при архивации сохраняется)
+    def find(self, invoice_id):
+        with self.engine.connect() as connection:
+            for table in self.partitions():
+                row = connection.execute(text(
+                    f'SELECT id, client_id, amount, status, created_at FROM {table} WHERE id = :id'),
+                    {'id': invoice_id}).first()
+                if row is not None:
+                    return row
+        return None
+
+    def stats(self):
+        return {'archived': self.archived, 'partitions': self.partitions(), 'last_run': self.last_run,
+                'last_vacuum': self.last_vacuum}
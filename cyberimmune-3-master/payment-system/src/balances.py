@@ -0,0 +1,81 @@
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from .archive import partition_tables
+
+# Суммы по клиенту: неоплаченные и оплаченные счета и предоплаты (вид записи, статус)
+BALANCE_SOURCES = {
+    'pending_invoices': ('invoices', 'PENDING'),
+    'pending_prepayments': ('prepayments', 'PENDING'),
+    'paid_invoices': ('invoices', 'PAID'),
+    'paid_prepayments': ('prepayments', 'PAID'),
+}
+BALANCE_FIELDS = tuple(BALANCE_SOURCES)
+# Расхождение меньше этого считается погрешностью сложения
+DRIFT_TOLERANCE = 1e-6
+
+UPSERT_QUERY = text(
+    f'INSERT INTO client_balance (client_id, {", ".join(BALANCE_FIELDS)}) '
+    f'VALUES (:client_id, {", ".join(":" + field for field in BALANCE_FIELDS)}) '
+    'ON CONFLICT (client_id) DO UPDATE SET '
+    + ', '.join(f'{field} = {field} + excluded.{field}' for field in BALANCE_FIELDS))
+
+
+# Изменения балансов, накопленные по клиентам; применяются одной пакетной командой
+class BalanceDelta:
+    def __init__(self):
+        self._deltas = defaultdict(lambda: dict.fromkeys(BALANCE_FIELDS, 0))
+
+    def add(self, client_id, field, amount):
+        self._deltas[client_id][field] += amount
+        return self
+
+    # Создан счёт или предоплата (kind - invoices или prepayments)
+    def created(self, client_id, kind, amount):
+        return self.add(client_id, f'pending_{kind}', amount)
+
+    def paid(self, client_id, kind, amount):
+        return self.add(client_id, f'pending_{kind}', -amount).add(client_id, f'paid_{kind}', amount)
+
+    # Выполняется в текущей транзакции вместе с изменениями счетов
+    def apply(self, session):
+        if self._deltas:
+            session.execute(UPSERT_QUERY, [dict(delta, client_id=client_id) for client_id, delta in self._deltas.items()])
+
+
+# Балансы, пересчитанные по исходным таблицам одним запросом
+def expected_balances_query(connection):
+    invoices = ['invoice', 'archived_invoice'] + partition_tables(connection)
+    sources = [f"SELECT 'invoices' AS kind, client_id, amount, status FROM {table}" for table in invoices]
+    sources.append("SELECT 'prepayments' AS kind, client_id, amount, status FROM prepayment")
+    sums = ', '.join(f"TOTAL(CASE WHEN kind = '{kind}' AND status = '{status}' THEN amount END) AS {field}"
+                     for field, (kind, status) in BALANCE_SOURCES.items())
+    return f'SELECT client_id, {sums} FROM ({" UNION ALL ".join(sources)}) GROUP BY client_id'
+
+
+def rebuild_balances(connection):
+    connection.exec_driver_sql('DELETE FROM client_balance')
+    connection.exec_driver_sql(
+        f'INSERT INTO client_balance (client_id, {", ".join(BALANCE_FIELDS)}) {expected_balances_query(connection)}')
+
+
+# Сверка балансов с исходными таблицами. Возвращает расхождения; при fix=True
+# балансы пересобираются. Сверка идёт под блокировкой записи, чтобы операции
+# между подсчётом и сравнением не давали ложных расхождений.
+def reconcile_balances(engine, fix=False):
+    with engine.connect() as connection:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        expected = {row[0]: row[1:] for row in connection.exec_driver_sql(expected_balances_query(connection))}
+        actual = {row[0]: row[1:] for row in connection.exec_driver_sql(
+            f'SELECT client_id, {", ".join(BALANCE_FIELDS)} FROM client_balance')}
+        zero = (0,) * len(BALANCE_FIELDS)
+        drift = []
+        for client_id in sorted(expected.keys() | actual.keys()):
+            for field, want, have in zip(BALANCE_FIELDS, expected.get(client_id, zero), actual.get(client_id, zero)):
+                if abs(want - have) > DRIFT_TOLERANCE:
+                    drift.append({'client_id': client_id, 'field': field, 'expected': want, 'actual': have})
+        if fix and drift:
+            rebuild_balances(connection)
+        connection.commit()
+    return {'clients': len(expected), 'drift': drift, 'fixed': bool(fix and drift)}
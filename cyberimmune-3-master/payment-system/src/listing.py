@@ -0,0 +1,89 @@
+import heapq
+import itertools
+import json
+import os
+
+from sqlalchemy import text
+
+# Размер страницы списков счетов и предоплат по умолчанию и максимальный
+LISTING_PAGE_LIMIT = int(os.getenv('LISTING_PAGE_LIMIT', 1000))
+
+HISTORY_FIELDS = ('id', 'amount', 'status', 'created_at')
+
+
+# Курсор страницы - (created_at, id) последней строки
+def encode_cursor(row):
+    return f'{row.created_at}|{row.id}'
+
+
+def decode_cursor(cursor):
+    created_at, separator, row_id = cursor.rpartition('|')
+    if not separator:
+        raise ValueError('Invalid cursor')
+    return created_at, int(row_id)
+
+
+def parse_fields(value, default):
+    if not value:
+        return default
+    fields = tuple(value.split(','))
+    unknown = set(fields) - set(HISTORY_FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown fields: {sorted(unknown)}')
+    return fields
+
+
+# Записи клиента из одной таблицы по индексу (client_id, created_at, id), без сортировки
+def table_statement(table, after):
+    keyset = ' AND (created_at, id) > (:after_created_at, :after_id)' if after else ''
+    return text(f'SELECT id, amount, status, created_at FROM {table} WHERE client_id = :client_id{keyset} '
+                'ORDER BY created_at, id LIMIT :limit')
+
+
+def read_table(connection, table, params, after):
+    yield from connection.execute(table_statement(table, after), params)
+
+
+# Месячные таблицы не пересекаются по времени: следующая читается, только когда
+# закончилась предыдущая, и не читается совсем, если страница уже заполнена
+def read_partitions(connection, tables, params, after):
+    for table in tables:
+        yield from read_table(connection, table, params, after)
+
+
+def history_key(row):
+    return row.created_at, row.id
+
+
+# История клиента из нескольких источников в порядке (created_at, id). Источник -
+# имя таблицы или список месячных таблиц от старых к новым. Каждая таблица читается
+# своим запросом по индексу с тем же лимитом, потоки сливаются без общей сортировки.
+# Возвращает итератор строк или None, если клиента нет.
+def read_history(connection, sources, client_id, after=None, limit=None):
+    if connection.execute(text('SELECT 1 FROM client WHERE id = :client_id'), {'client_id': client_id}).first() is None:
+        return None
+    params = {'client_id': client_id, 'limit': -1 if limit is None else limit}
+    if after:
+        params['after_created_at'], params['after_id'] = after
+    streams = [read_table(connection, source, params, after) if isinstance(source, str)
+               else read_partitions(connection, source, params, after) for source in sources]
+    rows = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=history_key)
+    return rows if limit is None else itertools.islice(rows, limit)
+
+
+# Строка истории в ответ: только запрошенные поля, статус и время без разбора в datetime
+def history_row(row, fields, statuses):
+    item = {}
+    for field in fields:
+        value = row[HISTORY_FIELDS.index(field)]
+        if field == 'status':
+            value = statuses[value]
+        elif field == 'created_at':
+            value = value[:19]
+        item[field] = value
+    return item
+
+
+def ndjson_lines(rows, fields, statuses):
+    for row in rows:
+        yield json.dumps(history_row(row, fields, statuses)) + '\n'
@@ -1,13 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, abort, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
+import json
 import os
-import requests
 import threading
 from datetime import datetime
 from enum import Enum
 from werkzeug.exceptions import HTTPException
 
+from . import http_client
+from .archive import InvoiceArchiver, partition_tables
+from .balances import BalanceDelta, rebuild_balances, reconcile_balances
+from .listing import (HISTORY_FIELDS, LISTING_PAGE_LIMIT, decode_cursor, encode_cursor, history_row, ndjson_lines,
+                      parse_fields, read_history)
+from .outbox import OUTBOX_DEAD_LETTERS_LIMIT, OutboxDispatcher
+from .storage import add_column, configure_engine, create_index, migrate
+
 MANAGMENT_URL = 'http://management_system:8000'
+# Максимальное число клиентов в ответе поиска
+CLIENT_SEARCH_LIMIT = int(os.getenv('CLIENT_SEARCH_LIMIT', 50))
+# Меньше трёх символов триграммный индекс не ищет, такие запросы ищутся по началу имени
+TRIGRAM_MIN_LENGTH = 3
+# Максимальное число записей в одном пакетном запросе
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 10000))
 
 HOST = '0.0.0.0'
 PORT = 8000
@@ -16,6 +33,9 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///payments.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
+with app.app_context():
+    configure_engine(db.engine)
+    engine = db.engine
 
 
 class PaymentStatus(Enum):
@@ -27,45 +47,235 @@ class PaymentStatus(Enum):
 # Модель для хранения клиентов
 class Client(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, unique=True, index=True)
+    # Нормализованное имя для точного поиска клиента
+    name_key = db.Column(db.String(100), unique=True, index=True)
     invoices = db.relationship('Invoice', backref='client', lazy=True)
     prepayments = db.relationship('Prepayment', backref='client', lazy=True)
 
+    @validates('name')
+    def set_name_key(self, key, name):
+        self.name_key = normalize_name(name)
+        return name
+
     def to_dict(self):
         return {"id": self.id, "name": self.name}
 
 
+# Имя без лишних пробелов и без учёта регистра
+def normalize_name(name):
+    return ' '.join(name.split()).casefold()
+
+
+# Полнотекстовый триграммный индекс имён клиентов, поддерживается триггерами
+CLIENT_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS client_search USING fts5("
+    "name, content='client', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS client_search_insert AFTER INSERT ON client BEGIN "
+    "INSERT INTO client_search (rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS client_search_delete AFTER DELETE ON client BEGIN "
+    "INSERT INTO client_search (client_search, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS client_search_update AFTER UPDATE OF name ON client BEGIN "
+    "INSERT INTO client_search (client_search, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO client_search (rowid, name) VALUES (new.id, new.name); END",
+)
+for statement in CLIENT_SEARCH_DDL:
+    event.listen(Client.__table__, 'after_create', DDL(statement))
+
+
 # Модель для хранения счетов
 class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.Enum(PaymentStatus), default=PaymentStatus.PENDING)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # AUTOINCREMENT: id счёта не используется повторно после переноса счетов с наибольшими id в архив
+    __table_args__ = (db.Index('ix_invoice_client_created', 'client_id', 'created_at', 'id'),
+                      {'sqlite_autoincrement': True})
 
 
 # Модель для хранения архивированных счетов
 class ArchivedInvoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.Enum(PaymentStatus), default=PaymentStatus.PAID)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_archived_invoice_client_created', 'client_id', 'created_at', 'id'),)
 
 
 # Модель для хранения предоплат
 class Prepayment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.Enum(PaymentStatus), default=PaymentStatus.PENDING)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_prepayment_client_created', 'client_id', 'created_at', 'id'),)
+
+
+# Балансы клиентов, обновляются в тех же транзакциях, что и счета и предоплаты
+class ClientBalance(db.Model):
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), primary_key=True)
+    pending_invoices = db.Column(db.Float, nullable=False, default=0)
+    pending_prepayments = db.Column(db.Float, nullable=False, default=0)
+    paid_invoices = db.Column(db.Float, nullable=False, default=0)
+    paid_prepayments = db.Column(db.Float, nullable=False, default=0)
 
 
-# Инициализация базы данных
-@app.before_first_request
-def create_tables():
-    db.create_all()
+# Вид записи для балансов клиента
+BALANCE_KINDS = {'invoice': 'invoices', 'prepayment': 'prepayments'}
+
+
+# Сообщения для системы управления, отправляются фоновым диспетчером
+class OutboxMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False, index=True)
+    topic = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.Float, nullable=False, default=0, index=True)
+    dead_letter = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# Миграции схемы базы (по порядку, применяются при старте сервиса)
+def add_lookup_indexes(connection):
+    create_index(connection, 'ix_client_name', 'client', ['name'], unique=True)
+    create_index(connection, 'ix_invoice_client_id', 'invoice', ['client_id'])
+    create_index(connection, 'ix_archived_invoice_client_id', 'archived_invoice', ['client_id'])
+    create_index(connection, 'ix_prepayment_client_id', 'prepayment', ['client_id'])
+
+
+def add_client_name_key(connection):
+    add_column(connection, 'client', 'name_key', 'VARCHAR(100)')
+    rows = connection.exec_driver_sql('SELECT id, name FROM client WHERE name_key IS NULL').fetchall()
+    if rows:
+        connection.exec_driver_sql('UPDATE client SET name_key = ? WHERE id = ?',
+                                   [(normalize_name(name), client_id) for client_id, name in rows])
+    create_index(connection, 'ix_client_name_key', 'client', ['name_key'], unique=True)
+
+
+def add_client_search(connection):
+    for statement in CLIENT_SEARCH_DDL:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql("INSERT INTO client_search (client_search) VALUES ('rebuild')")
+
+
+# Индексы для постраничного чтения истории клиента по (created_at, id)
+def add_history_indexes(connection):
+    tables = ['invoice', 'archived_invoice', 'prepayment']
+    tables += connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'archived_invoice_[0-9]*'").scalars().all()
+    for table in tables:
+        create_index(connection, f'ix_{table}_client_created', table, ['client_id', 'created_at', 'id'])
+
+
+def add_client_balances(connection):
+    rebuild_balances(connection)
+
+
+# Недоставленные сообщения outbox остаются в таблице с признаком dead_letter
+def add_outbox_dead_letters(connection):
+    add_column(connection, 'outbox_message', 'dead_letter', 'BOOLEAN NOT NULL DEFAULT 0')
+
+
+# Таблица invoice пересоздаётся с AUTOINCREMENT, счётчик id начинается выше всех id в архиве:
+# иначе после архивации последних счетов их id получали новые счета и чеки по id путались
+def add_invoice_autoincrement(connection):
+    indexes = connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'invoice' AND sql IS NOT NULL").scalars()
+    for name in indexes.all():
+        connection.exec_driver_sql(f'DROP INDEX {name}')
+    connection.exec_driver_sql('ALTER TABLE invoice RENAME TO invoice_rebuild')
+    Invoice.__table__.create(connection)
+    connection.exec_driver_sql('INSERT INTO invoice (id, client_id, amount, status, created_at) '
+                               'SELECT id, client_id, amount, status, created_at FROM invoice_rebuild')
+    connection.exec_driver_sql('DROP TABLE invoice_rebuild')
+    last_id = max(connection.exec_driver_sql(f'SELECT COALESCE(MAX(id), 0) FROM {table}').scalar()
+                  for table in ['invoice', 'archived_invoice', *partition_tables(connection)])
+    if not connection.exec_driver_sql("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'invoice'",
+                                      (last_id,)).rowcount:
+        connection.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('invoice', ?)", (last_id,))
+
+
+MIGRATIONS = [add_lookup_indexes, add_client_name_key, add_client_search, add_history_indexes, add_client_balances,
+              add_outbox_dead_letters, add_invoice_autoincrement]
+
+
+def migrate_database():
+    with app.app_context():
+        migrate(db.engine, db.metadata, MIGRATIONS)
+
+
+# Доставка пакета сообщений в систему управления, возвращает результат по каждому сообщению
+def send_events(messages):
+    response = http_client.post(f'{MANAGMENT_URL}/events/batch', json={'events': messages})
+    response.raise_for_status()
+    return {result['id']: result['ok'] for result in response.json()['results']}
+
+
+outbox = OutboxDispatcher(engine, send_events)
+# Оплаченные счета переносятся в месячные таблицы архива фоновой задачей
+archiver = InvoiceArchiver(engine)
+
+
+# Сообщение записывается в текущую транзакцию и уходит после её фиксации
+def enqueue_event(client, topic, data):
+    db.session.add(OutboxMessage(**outbox_message(client.id, client.name, topic, data)))
+
+
+def outbox_message(client_id, name, topic, data):
+    return {'client_id': client_id, 'topic': topic, 'payload': json.dumps({'name': name, 'data': data})}
+
+
+STATUS_VALUES = {status.name: status.value for status in PaymentStatus}
+
+
+# Список истории клиента: постранично по курсору (created_at, id) с выбором полей
+# или целиком потоком NDJSON (format=ndjson)
+def client_history_response(client_id, sources, default_fields):
+    try:
+        fields = parse_fields(request.args.get('fields'), default_fields)
+        after = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if request.args.get('format') == 'ndjson':
+        connection = engine.connect()
+        try:
+            rows = read_history(connection, sources, client_id, after, request.args.get('limit', type=int))
+        except BaseException:
+            connection.close()
+            raise
+        if rows is None:
+            connection.close()
+            abort(404)
+        response = Response(ndjson_lines(rows, fields, STATUS_VALUES), mimetype='application/x-ndjson')
+        # Соединение закрывается сервером по окончании ответа, даже если поток не был прочитан
+        response.call_on_close(connection.close)
+        return response
+    limit = min(request.args.get('limit', LISTING_PAGE_LIMIT, type=int), LISTING_PAGE_LIMIT)
+    with engine.connect() as connection:
+        rows = read_history(connection, sources, client_id, after, limit + 1)
+        if rows is None:
+            abort(404)
+        rows = list(rows)
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(rows[-1])
+    return jsonify([history_row(row, fields, STATUS_VALUES) for row in rows]), 200, headers
+
+
+def invoice_receipt(invoice):
+    return {
+        'id': invoice.id,
+        'amount': invoice.amount,
+        'status': invoice.status.value,
+        'created_at': invoice.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'client_id': invoice.client_id
+    }
 
 
 # Создание клиента
@@ -75,14 +285,39 @@ def create_or_exists_client():
     name = data.get('name')
     if not name:
         return jsonify({'error': 'Client name is required'}), 400
-    clients = Client.query.filter(Client.name.ilike(f'%{name}%')).all()
-    if clients:
-        return jsonify([client.to_dict() for client in clients]), 200
-    else:
-        client = Client(name=name)
-        db.session.add(client)
+    # Точный поиск по нормализованному имени; ответ остаётся списком для совместимости
+    name_key = normalize_name(name)
+    client = Client.query.filter_by(name_key=name_key).order_by(Client.id).first()
+    if client:
+        return jsonify([client.to_dict()]), 200
+    client = Client(name=name)
+    db.session.add(client)
+    try:
         db.session.commit()
-        return jsonify([{'id': client.id, 'name': client.name}]), 201
+    except IntegrityError:
+        # Клиента с тем же именем создали параллельным запросом
+        db.session.rollback()
+        client = Client.query.filter_by(name_key=name_key).order_by(Client.id).first()
+        return jsonify([client.to_dict()]), 200
+    return jsonify([{'id': client.id, 'name': client.name}]), 201
+
+
+# Поиск клиентов по части имени
+@app.route('/clients/search', methods=['GET'])
+def search_clients():
+    query = normalize_name(request.args.get('q', ''))
+    if not query:
+        return jsonify({'error': 'Search query is required'}), 400
+    limit = min(request.args.get('limit', CLIENT_SEARCH_LIMIT, type=int), CLIENT_SEARCH_LIMIT)
+    if len(query) < TRIGRAM_MIN_LENGTH:
+        clients = Client.query.filter(Client.name_key >= query, Client.name_key < query + '\U0010ffff') \
+            .order_by(Client.name_key).limit(limit).all()
+        return jsonify([client.to_dict() for client in clients])
+    phrase = '"' + query.replace('"', '""') + '"'
+    rows = db.session.execute(text(
+        'SELECT client.id, client.name FROM client_search JOIN client ON client.id = client_search.rowid '
+        'WHERE client_search MATCH :phrase ORDER BY rank LIMIT :limit'), {'phrase': phrase, 'limit': limit})
+    return jsonify([{'id': row.id, 'name': row.name} for row in rows])
 
 
 # Получение клиента по ID
@@ -102,6 +337,7 @@ def create_invoice():
         return jsonify({'error': 'Client ID and amount are required'}), 400
     invoice = Invoice(client_id=client_id, amount=amount)
     db.session.add(invoice)
+    BalanceDelta().created(client_id, 'invoices', amount).apply(db.session)
     db.session.commit()
     return jsonify({'id': invoice.id, 'amount': invoice.amount, 'status': invoice.status.value, 'client_id': invoice.client_id}), 201
 
@@ -109,9 +345,7 @@ def create_invoice():
 # Получение всех счетов по ID клиента
 @app.route('/clients/<int:client_id>/invoices', methods=['GET'])
 def get_invoices_by_client(client_id: int):
-    client = Client.query.get_or_404(client_id)
-    invoices = Invoice.query.filter_by(client_id=client.id).all()
-    return jsonify([{'id': invoice.id, 'amount': invoice.amount, 'status': invoice.status.value} for invoice in invoices])
+    return client_history_response(client_id, ['invoice'], ('id', 'amount', 'status'))
 
 
 # Получение оплаты
@@ -125,45 +359,66 @@ def get_invoice(invoice_id: int):
 @app.route('/invoices/<int:invoice_id>/confirm', methods=['POST'])
 def confirm_payment(invoice_id: int):
     invoice = Invoice.query.get_or_404(invoice_id)
+    # Повторное подтверждение: сообщение в систему управления уже в очереди
+    if invoice.status == PaymentStatus.PAID:
+        return jsonify({'id': invoice.id, 'status': invoice.status.value})
     client = Client.query.get(invoice.client_id)
+    BalanceDelta().paid(invoice.client_id, 'invoices', invoice.amount).apply(db.session)
     invoice.status = PaymentStatus.PAID
+    # Чек передаётся в систему управления вместе с подтверждением, финальный чек она отдаёт по /receipts/<id>
+    enqueue_event(client, 'payment_confirmed',
+                  {'id': invoice.id, 'status': invoice.status.value, 'receipt': invoice_receipt(invoice)})
     db.session.commit()
-    final_receipt = requests.post(f'{MANAGMENT_URL}/confirm_payment/{client.name}', json={'id': invoice.id, 'status': invoice.status.value})
-    return jsonify({'id': invoice.id, 'status': invoice.status.value, 'final_receipt': final_receipt.json()})
+    outbox.notify()
+    return jsonify({'id': invoice.id, 'status': invoice.status.value})
 
 # Отправка чека
 @app.route('/invoices/<int:invoice_id>/receipt', methods=['GET'])
 def send_receipt(invoice_id: int):
-    invoice = Invoice.query.get_or_404(invoice_id)
-    receipt = {
-        'id': invoice.id,
-        'amount': invoice.amount,
-        'status': invoice.status.value,
-        'created_at': invoice.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        'client_id': invoice.client_id
-    }
-    # Переносим счет в архив
-    archived_invoice = ArchivedInvoice(
-        client_id=invoice.client_id,
-        amount=invoice.amount,
-        created_at=invoice.created_at)
-    db.session.add(archived_invoice)
-    db.session.delete(invoice)
-    db.session.commit()
+    # Только чтение: счёт ищется среди текущих, затем в архиве
+    invoice = db.session.get(Invoice, invoice_id)
+    if invoice is not None:
+        receipt = invoice_receipt(invoice)
+    else:
+        row = archiver.find(invoice_id)
+        if row is None:
+            return jsonify({'error': 'Invoice not found'}), 404
+        receipt = {
+            'id': row.id,
+            'amount': row.amount,
+            'status': PaymentStatus[row.status].value,
+            'created_at': row.created_at[:19],
+            'client_id': row.client_id
+        }
     return jsonify({'message': 'Receipt sent', 'receipt': receipt})
 
 
 # Получение всех архивированных счетов
 @app.route('/clients/<int:client_id>/archived_invoices', methods=['GET'])
 def get_archived_invoices_by_client(client_id: int):
-    client = Client.query.get_or_404(client_id)
-    archived_invoices = ArchivedInvoice.query.filter_by(client_id=client.id).all()
-    return jsonify([{
-        'id': archived_invoice.id,
-        'amount': archived_invoice.amount,
-        'status': archived_invoice.status.value,
-        'created_at': archived_invoice.created_at.strftime('%Y-%m-%d %H:%M:%S')
-    } for archived_invoice in archived_invoices])
+    # Счета, заархивированные до разбиения архива по месяцам, и месячные таблицы архива от старых к новым
+    return client_history_response(client_id, ['archived_invoice', sorted(archiver.partitions())], HISTORY_FIELDS)
+
+
+# Запуск архивации вне расписания
+@app.route('/archive/run', methods=['POST'])
+def run_archive():
+    min_age = request.args.get('min_age')
+    try:
+        min_age = None if min_age is None else float(min_age)
+    except ValueError:
+        min_age = -1
+    if min_age is not None and not min_age >= 0:
+        return jsonify({'error': 'min_age must be a non-negative number'}), 400
+    archived = archiver.archive(min_age)
+    if request.args.get('vacuum') == 'true':
+        archiver.vacuum()
+    return jsonify({'archived': archived})
+
+
+@app.route('/archive/stats', methods=['GET'])
+def get_archive_stats():
+    return jsonify(archiver.stats())
 
 
 # Создание предоплаты
@@ -175,27 +430,216 @@ def create_prepayment(client_id: int):
         return jsonify({'error': 'Amount is required'}), 400
     prepayment = Prepayment(client_id=client_id, amount=amount)
     db.session.add(prepayment)
+    BalanceDelta().created(client_id, 'prepayments', amount).apply(db.session)
     db.session.commit()
     return jsonify({'id': prepayment.id, 'amount': prepayment.amount, 'client_id': prepayment.client_id, 'status': prepayment.status.value}), 201
 
 
+# Получение предоплаты
+@app.route('/prepayment/<int:prepayment_id>', methods=['GET'])
+def get_prepayment(prepayment_id: int):
+    prepayment = Prepayment.query.get_or_404(prepayment_id)
+    return jsonify({'id': prepayment.id, 'amount': prepayment.amount, 'client_id': prepayment.client_id, 'status': prepayment.status.value})
+
+
 # Подтверждение предоплаты
 @app.route('/prepayment/<int:prepayment_id>/confirm', methods=['POST'])
 def confirm_prepayment(prepayment_id: int):
     prepayment = Prepayment.query.get_or_404(prepayment_id)
+    if prepayment.status == PaymentStatus.PAID:
+        return jsonify({'id': prepayment.id, 'status': prepayment.status.value})
     client = Client.query.get(prepayment.client_id)
+    BalanceDelta().paid(prepayment.client_id, 'prepayments', prepayment.amount).apply(db.session)
     prepayment.status = PaymentStatus.PAID
+    enqueue_event(client, 'prepayment_confirmed', {'id': prepayment.id, 'status': prepayment.status.value})
     db.session.commit()
-    requests.post(f'{MANAGMENT_URL}/confirm_prepayment/{client.name}', json={'id': prepayment.id, 'status': prepayment.status.value})
+    outbox.notify()
     return jsonify({'id': prepayment.id, 'status': prepayment.status.value})
 
 
+# Пакетное создание счетов или предоплат: проверка всех записей, затем одна вставка в одной транзакции
+def create_batch(model, items):
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Non-empty list is required'}), 400
+    if len(items) > BATCH_MAX_SIZE:
+        return jsonify({'error': f'Batch is limited to {BATCH_MAX_SIZE} items'}), 400
+    client_ids = {item.get('client_id') for item in items if isinstance(item, dict)}
+    existing = set(db.session.scalars(select(Client.id).where(Client.id.in_(client_ids))))
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'ok': False, 'error': 'Item must be an object'})
+            continue
+        client_id = item.get('client_id')
+        amount = item.get('amount')
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool) or amount <= 0:
+            results.append({'index': index, 'ok': False, 'error': 'Positive amount is required'})
+        elif client_id not in existing:
+            results.append({'index': index, 'ok': False, 'error': 'Client not found'})
+        else:
+            results.append(None)
+            rows.append({'client_id': client_id, 'amount': amount})
+    if rows:
+        created = iter(db.session.execute(
+            insert(model).returning(model.id, model.client_id, model.amount, model.status, sort_by_parameter_order=True),
+            rows).all())
+        balances = BalanceDelta()
+        for row in rows:
+            balances.created(row['client_id'], BALANCE_KINDS[model.__tablename__], row['amount'])
+        balances.apply(db.session)
+        db.session.commit()
+        for index, result in enumerate(results):
+            if result is None:
+                row = next(created)
+                results[index] = {'index': index, 'ok': True, 'id': row.id, 'client_id': row.client_id,
+                                  'amount': row.amount, 'status': row.status.value}
+    return jsonify({'created': len(rows), 'results': results})
+
+
+# Пакетное подтверждение: одно обновление статусов и сообщения в системе управления
+# в одной транзакции, диспетчер получает их разом после фиксации.
+# Сообщения и балансы - только по записям, которые обновление действительно перевело в PAID:
+# запись, оплаченная параллельным запросом, повторно не подтверждается.
+def confirm_batch(model, ids, topic, message_data):
+    if not isinstance(ids, list) or not ids:
+        return jsonify({'error': 'Non-empty list of ids is required'}), 400
+    if len(ids) > BATCH_MAX_SIZE:
+        return jsonify({'error': f'Batch is limited to {BATCH_MAX_SIZE} items'}), 400
+    if not all(isinstance(record_id, int) and not isinstance(record_id, bool) for record_id in ids):
+        return jsonify({'error': 'Ids must be integers'}), 400
+    rows = {row.id: row for row in db.session.execute(
+        select(model.id, model.client_id, model.amount, model.status, model.created_at, Client.name)
+        .join(Client, Client.id == model.client_id).where(model.id.in_(set(ids))))}
+    pending = [record_id for record_id, row in rows.items() if row.status != PaymentStatus.PAID]
+    confirmed = {}
+    if pending:
+        changed = db.session.execute(
+            update(model).where(model.id.in_(pending), model.status != PaymentStatus.PAID)
+            .values(status=PaymentStatus.PAID).returning(model.id)
+            .execution_options(synchronize_session=False)).scalars().all()
+        confirmed = {record_id: rows[record_id] for record_id in changed}
+    results = []
+    reported = set()
+    for record_id in ids:
+        if record_id not in rows:
+            results.append({'id': record_id, 'ok': False, 'error': 'Not found'})
+        elif record_id in confirmed and record_id not in reported:
+            reported.add(record_id)
+            results.append({'id': record_id, 'ok': True, 'status': PaymentStatus.PAID.value})
+        else:
+            results.append({'id': record_id, 'ok': False, 'error': 'Already paid'})
+    if confirmed:
+        db.session.execute(insert(OutboxMessage), [
+            outbox_message(row.client_id, row.name, topic, message_data(row)) for row in confirmed.values()])
+        balances = BalanceDelta()
+        for row in confirmed.values():
+            balances.paid(row.client_id, BALANCE_KINDS[model.__tablename__], row.amount)
+        balances.apply(db.session)
+    db.session.commit()
+    if confirmed:
+        outbox.notify()
+    return jsonify({'confirmed': len(confirmed), 'results': results})
+
+
+def confirmed_invoice_data(row):
+    receipt = {
+        'id': row.id,
+        'amount': row.amount,
+        'status': PaymentStatus.PAID.value,
+        'created_at': row.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'client_id': row.client_id
+    }
+    return {'id': row.id, 'status': PaymentStatus.PAID.value, 'receipt': receipt}
+
+
+def confirmed_prepayment_data(row):
+    return {'id': row.id, 'status': PaymentStatus.PAID.value}
+
+
+# Пакетное создание счетов
+@app.route('/invoices/batch', methods=['POST'])
+def create_invoices_batch():
+    return create_batch(Invoice, request.json.get('invoices'))
+
+
+# Пакетное подтверждение оплаты счетов
+@app.route('/invoices/confirm/batch', methods=['POST'])
+def confirm_invoices_batch():
+    return confirm_batch(Invoice, request.json.get('ids'), 'payment_confirmed', confirmed_invoice_data)
+
+
+# Пакетное создание предоплат
+@app.route('/prepayments/batch', methods=['POST'])
+def create_prepayments_batch():
+    return create_batch(Prepayment, request.json.get('prepayments'))
+
+
+# Пакетное подтверждение предоплат
+@app.route('/prepayments/confirm/batch', methods=['POST'])
+def confirm_prepayments_batch():
+    return confirm_batch(Prepayment, request.json.get('ids'), 'prepayment_confirmed', confirmed_prepayment_data)
+
+
 # Получение всех предоплат по ID клиента
 @app.route('/clients/<int:client_id>/prepayments', methods=['GET'])
 def get_prepayments_by_client(client_id: int):
-    client = Client.query.get_or_404(client_id)
-    prepayments = Prepayment.query.filter_by(client_id=client.id).all()
-    return jsonify([{'id': prepayment.id, 'amount': prepayment.amount, 'status': prepayment.status.value} for prepayment in prepayments])
+    return client_history_response(client_id, ['prepayment'], ('id', 'amount', 'status'))
+
+
+# Баланс клиента: чтение одной строки по первичному ключу
+@app.route('/clients/<int:client_id>/balance', methods=['GET'])
+def get_client_balance(client_id: int):
+    balance = db.session.get(ClientBalance, client_id)
+    if balance is None:
+        # Клиент без счетов и предоплат
+        client = Client.query.get_or_404(client_id)
+        balance = ClientBalance(client_id=client.id, pending_invoices=0, pending_prepayments=0, paid_invoices=0,
+                                paid_prepayments=0)
+    return jsonify({
+        'client_id': balance.client_id,
+        'outstanding': balance.pending_invoices + balance.pending_prepayments,
+        'lifetime_spend': balance.paid_invoices + balance.paid_prepayments,
+        'pending_invoices': balance.pending_invoices,
+        'pending_prepayments': balance.pending_prepayments,
+        'paid_invoices': balance.paid_invoices,
+        'paid_prepayments': balance.paid_prepayments
+    })
+
+
+# Сверка балансов с исходными таблицами, fix=true - пересобрать балансы
+@app.route('/balances/reconcile', methods=['POST'])
+def reconcile_client_balances():
+    return jsonify(reconcile_balances(engine, fix=request.args.get('fix') == 'true'))
+
+
+# Статистика вызовов других сервисов
+@app.route('/http/stats', methods=['GET'])
+def get_http_stats():
+    return jsonify(http_client.stats())
+
+
+# Состояние очереди сообщений для других сервисов
+@app.route('/outbox/stats', methods=['GET'])
+def get_outbox_stats():
+    return jsonify(outbox.stats())
+
+
+# Сообщения, не доставленные за OUTBOX_MAX_ATTEMPTS попыток
+@app.route('/outbox/dead_letters', methods=['GET'])
+def get_outbox_dead_letters():
+    limit = min(request.args.get('limit', OUTBOX_DEAD_LETTERS_LIMIT, type=int), OUTBOX_DEAD_LETTERS_LIMIT)
+    return jsonify(outbox.dead_letters(limit))
+
+
+# Повторная отправка недоставленных сообщений: всех или перечисленных в ids
+@app.route('/outbox/redrive', methods=['POST'])
+def redrive_outbox():
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if ids is not None and not (isinstance(ids, list) and all(
+            isinstance(value, int) and not isinstance(value, bool) for value in ids)):
+        return jsonify({'error': 'ids must be a list of integers'}), 400
+    return jsonify({'redriven': outbox.redrive(ids)})
 
 
 @app.errorhandler(HTTPException)
@@ -208,6 +652,9 @@ def handle_exception(e):
 
 
 def start_web():
+    migrate_database()
+    outbox.start()
+    archiver.start()
     threading.Thread(target=lambda: app.run(
         host=HOST, port=PORT, debug=True, use_reloader=False
     )).start()
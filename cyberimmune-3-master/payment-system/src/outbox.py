@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# Сколько сообщений отправляется одним запросом
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+# Период проверки неотправленных сообщений в секундах
+OUTBOX_INTERVAL = float(os.getenv('OUTBOX_INTERVAL', 1))
+# Начальная и максимальная задержка повторной отправки в секундах
+OUTBOX_RETRY_DELAY = float(os.getenv('OUTBOX_RETRY_DELAY', 1))
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv('OUTBOX_RETRY_MAX_DELAY', 60))
+# После стольких неудачных попыток сообщение откладывается в недоставленные, чтобы не держать очередь клиента
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 20))
+# Максимальное число недоставленных сообщений в одном ответе
+OUTBOX_DEAD_LETTERS_LIMIT = int(os.getenv('OUTBOX_DEAD_LETTERS_LIMIT', 100))
+
+# Сообщения клиента не обгоняют друг друга: пока у клиента есть сообщение,
+# ожидающее повтора, его следующие сообщения тоже не отправляются
+PENDING_QUERY = text(
+    'SELECT id, client_id, topic, payload, attempts FROM outbox_message '
+    'WHERE NOT dead_letter AND client_id NOT IN '
+    '(SELECT client_id FROM outbox_message WHERE NOT dead_letter AND next_attempt_at > :now) '
+    'ORDER BY id LIMIT :limit')
+DELETE_QUERY = text('DELETE FROM outbox_message WHERE id = :id')
+RETRY_QUERY = text('UPDATE outbox_message SET attempts = attempts + 1, next_attempt_at = :next_attempt_at '
+                   'WHERE id = :id')
+DEAD_LETTER_QUERY = text('UPDATE outbox_message SET attempts = attempts + 1, dead_letter = 1 WHERE id = :id')
+DEAD_LETTERS_QUERY = text(
+    'SELECT id, client_id, topic, payload, attempts, created_at FROM outbox_message '
+    'WHERE dead_letter ORDER BY id LIMIT :limit')
+# Повторная отправка недоставленных сообщений начинается с первой попытки
+REDRIVE_QUERY = text('UPDATE outbox_message SET dead_letter = 0, attempts = 0, next_attempt_at = 0 WHERE dead_letter')
+REDRIVE_IDS_QUERY = text(
+    'UPDATE outbox_message SET dead_letter = 0, attempts = 0, next_attempt_at = 0 '
+    'WHERE dead_letter AND id IN :ids').bindparams(bindparam('ids', expanding=True))
+
+
+# Фоновая отправка сообщений из таблицы outbox. Сообщения пишутся в той же
+# транзакции, что и изменения, о которых они сообщают, поэтому обработчик
+# запроса не ждёт другой сервис, а сообщение не теряется при сбое отправки.
+# Сообщения, не доставленные за max_attempts попыток, остаются в таблице как недоставленные
+# (dead_letter) и не задерживают следующие сообщения клиента; вернуть их в отправку можно через redrive.
+class OutboxDispatcher:
+    def __init__(self, engine, send, batch_size=OUTBOX_BATCH_SIZE, interval=OUTBOX_INTERVAL,
+                 retry_delay=OUTBOX_RETRY_DELAY, retry_max_delay=OUTBOX_RETRY_MAX_DELAY,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.engine = engine
+        self.send = send
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.max_attempts = max_attempts
+        self.delivered = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self._wakeup = threading.Event()
+        self._dispatch_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+
+    # Вызывается после фиксации транзакции с новыми сообщениями
+    def notify(self):
+        self._wakeup.set()
+
+    # Отправка одного пакета, возвращает число доставленных сообщений
+    def dispatch(self):
+        with self._dispatch_lock:
+            now = time.time()
+            with self.engine.connect() as connection:
+                rows = connection.execute(PENDING_QUERY, {'now': now, 'limit': self.batch_size}).fetchall()
+            if not rows:
+                return 0
+            messages = [dict(json.loads(row.payload), id=row.id, topic=row.topic) for row in rows]
+            try:
+                results = self.send(messages)
+            except Exception as e:
+                print(f'Ошибка отправки сообщений ({len(messages)}): {e}')
+                results = {}
+            delivered = [{'id': row.id} for row in rows if results.get(row.id)]
+            failed = []
+            dead_letters = []
+            for row, message in zip(rows, messages):
+                if results.get(row.id):
+                    continue
+                if row.attempts + 1 >= self.max_attempts:
+                    print(f'Сообщение не доставлено за {row.attempts + 1} попыток: {message}')
+                    dead_letters.append({'id': row.id})
+                else:
+                    delay = min(self.retry_delay * 2 ** row.attempts, self.retry_max_delay)
+                    failed.append({'id': row.id, 'next_attempt_at': now + delay})
+            with self.engine.begin() as connection:
+                if delivered:
+                    connection.execute(DELETE_QUERY, delivered)
+                if failed:
+                    connection.execute(RETRY_QUERY, failed)
+                if dead_letters:
+                    connection.execute(DEAD_LETTER_QUERY, dead_letters)
+            self.delivered += len(delivered)
+            self.failed += len(failed)
+            self.dead_lettered += len(dead_letters)
+            return len(delivered)
+
+    def dead_letters(self, limit):
+        with self.engine.connect() as connection:
+            rows = connection.execute(DEAD_LETTERS_QUERY, {'limit': limit}).fetchall()
+        return [dict(json.loads(row.payload), id=row.id, client_id=row.client_id, topic=row.topic,
+                     attempts=row.attempts, created_at=row.created_at) for row in rows]
+
+    # Возврат недоставленных сообщений (всех или с указанными ИД) в отправку
+    def redrive(self, ids=None):
+        with self.engine.begin() as connection:
+            if ids is None:
+                redriven = connection.execute(REDRIVE_QUERY).rowcount
+            else:
+                redriven = connection.execute(REDRIVE_IDS_QUERY, {'ids': ids}).rowcount if ids else 0
+        if redriven:
+            self.notify()
+        return redriven
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                # Пока пакеты доставляются целиком, сразу отправляем следующий
+                while self.dispatch() == self.batch_size:
+                    pass
+            except SQLAlchemyError as e:
+                print(f'Ошибка чтения сообщений outbox: {e}')
+
+    def stats(self):
+        with self.engine.connect() as connection:
+            pending, dead_letters = connection.execute(text(
+                'SELECT COUNT(*) - COALESCE(SUM(dead_letter), 0), COALESCE(SUM(dead_letter), 0) FROM outbox_message')).one()
+        return {'pending': pending, 'dead_letters': dead_letters, 'delivered': self.delivered, 'failed': self.failed,
+                'dead_lettered': self.dead_lettered}
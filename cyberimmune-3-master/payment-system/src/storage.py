@@ -0,0 +1,62 @@
+import os
+import sqlite3
+
+from sqlalchemy import event, inspect
+
+# Настройки SQLite: журнал WAL, режим синхронизации и размер кэша страниц (отрицательный - в КиБ)
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', -65536))
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record=None):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+    cursor.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA cache_size = {SQLITE_CACHE_SIZE}')
+    cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}')
+    cursor.execute('PRAGMA temp_store = MEMORY')
+    cursor.close()
+
+
+def configure_engine(engine):
+    event.listen(engine, 'connect', set_sqlite_pragmas)
+
+
+# Миграции схемы при старте сервиса. Номер применённой миграции хранится в PRAGMA user_version.
+# Новая база сразу создаётся по текущим моделям, в существующей выполняются недостающие миграции.
+def migrate(engine, metadata, migrations):
+    with engine.begin() as connection:
+        version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+        fresh = not inspect(connection).get_table_names()
+        metadata.create_all(connection)
+        if fresh:
+            version = len(migrations)
+        for number, migration in enumerate(migrations[version:], start=version + 1):
+            print(f'Применяется миграция {number}: {migration.__name__}')
+            migration(connection)
+        connection.exec_driver_sql(f'PRAGMA user_version = {len(migrations)}')
+    return len(migrations)
+
+
+# Создание индекса; если уникальный индекс невозможен из-за дублей, создаётся обычный
+def create_index(connection, name, table, columns, unique=False):
+    columns = ', '.join(columns)
+    if unique:
+        duplicates = connection.exec_driver_sql(
+            f'SELECT COUNT(*) FROM (SELECT 1 FROM {table} GROUP BY {columns} HAVING COUNT(*) > 1)').scalar()
+        if duplicates:
+            print(f'В таблице {table} есть повторяющиеся значения {columns} ({duplicates}), '
+                  f'индекс {name} создаётся без уникальности')
+            unique = False
+    connection.exec_driver_sql(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+
+
+# Добавление столбца, если его ещё нет (таблица могла быть создана уже по новой модели)
+def add_column(connection, table, column, definition):
+    columns = {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        connection.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
@@ -0,0 +1,33 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'management-system'))
+
+from src.stream import FleetStream  # noqa: E402
+
+CARS = 10000
+TICKS = 10
+
+
+# Замер стоимости рассылки обновлений автопарка при разном числе подписчиков
+def bench_fleet_stream():
+    statuses = [(f'car-{i}', {'coordinates': [i % 100, i % 50], 'speed': 42.0, 'is_running': True,
+                              'is_in_service_zone': True}) for i in range(CARS)]
+    for count in (1, 10, 100):
+        stream = FleetStream(interval=3600, max_subscribers=count)
+        subscribers = [stream.subscribe() for _ in range(count)]
+        elapsed = 0.0
+        for tick in range(TICKS):
+            for brand, status in statuses:
+                stream.publish(brand, status)
+            start = time.perf_counter()
+            stream.flush()
+            elapsed += time.perf_counter() - start
+            for subscriber in subscribers:
+                subscriber.take(0)
+        print(f'{count} подписчиков: {elapsed / TICKS * 1000:.2f} мс на рассылку {CARS} обновлений')
+
+
+if __name__ == '__main__':
+    bench_fleet_stream()
@@ -0,0 +1,36 @@
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'cars'))
+
+from src.main import Car, fleet, registry, simulate_drive, telemetry  # noqa: E402
+
+CARS = int(os.getenv('BENCH_CARS', 100000))
+TICKS = 10
+
+
+# Полный такт симуляции (движение, кодирование телеметрии, сообщения) на большом автопарке
+def bench_fleet_tick():
+    cars = [Car(f'Bench-{i}') for i in range(CARS)]
+    registry.extend(cars)
+    for car in cars:
+        car.start()
+    telemetry.send = lambda batch: None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        simulate_drive()
+        start = time.perf_counter()
+        for _ in range(TICKS):
+            fleet.tick()
+        fleet_tick = (time.perf_counter() - start) / TICKS
+        start = time.perf_counter()
+        for _ in range(TICKS):
+            simulate_drive()
+        drive = (time.perf_counter() - start) / TICKS
+    print(f'{CARS} автомобилей: движение {fleet_tick * 1000:.1f} мс, '
+          f'такт с телеметрией {drive * 1000:.1f} мс')
+
+
+if __name__ == '__main__':
+    bench_fleet_tick()
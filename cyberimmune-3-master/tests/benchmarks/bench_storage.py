@@ -0,0 +1,103 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'payment-system'))
+
+from src.main import MIGRATIONS, db, normalize_name  # noqa: E402
+from src.storage import configure_engine, migrate  # noqa: E402
+
+CLIENTS = int(os.getenv('BENCH_CLIENTS', 1_000_000))
+INVOICES = int(os.getenv('BENCH_INVOICES', 10_000_000))
+LOOKUPS = 10000
+COMMITS = 1000
+CHUNK = 100000
+
+
+def fill(engine):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for start in range(0, CLIENTS, CHUNK):
+            cursor.executemany('INSERT INTO client (id, name, name_key) VALUES (?, ?, ?)',
+                               ((i, f'Client-{i}', normalize_name(f'Client-{i}'))
+                                for i in range(start + 1, min(start + CHUNK, CLIENTS) + 1)))
+        created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+        for start in range(0, INVOICES, CHUNK):
+            cursor.executemany(
+                'INSERT INTO invoice (client_id, amount, status, created_at) VALUES (?, ?, ?, ?)',
+                ((random.randint(1, CLIENTS), 100.0, 'PAID', created_at)
+                 for _ in range(start, min(start + CHUNK, INVOICES))))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def lookup_latency(engine):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        start = time.perf_counter()
+        for _ in range(LOOKUPS):
+            client_id = cursor.execute('SELECT id FROM client WHERE name_key = ?',
+                                       (normalize_name(f'Client-{random.randint(1, CLIENTS)}'),)).fetchone()[0]
+            cursor.execute('SELECT id, amount, status FROM invoice WHERE client_id = ?', (client_id,)).fetchall()
+        return (time.perf_counter() - start) / LOOKUPS
+    finally:
+        connection.close()
+
+
+def search_latency(engine):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        start = time.perf_counter()
+        for _ in range(LOOKUPS):
+            cursor.execute('SELECT client.id, client.name FROM client_search '
+                           'JOIN client ON client.id = client_search.rowid '
+                           'WHERE client_search MATCH ? ORDER BY rank LIMIT 50',
+                           (f'"{random.randint(1, CLIENTS)}"',)).fetchall()
+        return (time.perf_counter() - start) / LOOKUPS
+    finally:
+        connection.close()
+
+
+def commit_latency(engine):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        start = time.perf_counter()
+        for _ in range(COMMITS):
+            cursor.execute('INSERT INTO invoice (client_id, amount, status) VALUES (?, ?, ?)',
+                           (random.randint(1, CLIENTS), 100.0, 'PENDING'))
+            connection.commit()
+        return (time.perf_counter() - start) / COMMITS
+    finally:
+        connection.close()
+
+
+# Задержка поиска клиента со счетами и фиксации транзакции на большой базе системы оплаты
+def bench_storage():
+    with tempfile.TemporaryDirectory() as directory:
+        tuned = create_engine(f'sqlite:///{directory}/tuned.db')
+        configure_engine(tuned)
+        migrate(tuned, db.metadata, MIGRATIONS)
+        start = time.perf_counter()
+        fill(tuned)
+        print(f'Заполнение: {CLIENTS} клиентов и {INVOICES} счетов за {time.perf_counter() - start:.1f} с')
+        print(f'Поиск клиента по имени и его счетов: {lookup_latency(tuned) * 1e6:.1f} мкс')
+        print(f'Поиск клиентов по части имени: {search_latency(tuned) * 1e6:.1f} мкс')
+        print(f'Фиксация транзакции (WAL, synchronous=NORMAL): {commit_latency(tuned) * 1e6:.1f} мкс')
+
+        default = create_engine(f'sqlite:///{directory}/default.db')
+        migrate(default, db.metadata, MIGRATIONS)
+        print(f'Фиксация транзакции (настройки SQLite по умолчанию): {commit_latency(default) * 1e6:.1f} мкс')
+
+
+if __name__ == '__main__':
+    bench_storage()
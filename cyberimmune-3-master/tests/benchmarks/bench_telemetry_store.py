@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'management-system'))
+
+from src.timeseries import TelemetryStore  # noqa: E402
+
+CARS = 10000
+TICKS = 20
+
+
+# Замер скорости приёма телеметрии в буфер и пакетной записи в базу
+def bench_telemetry_store():
+    with tempfile.TemporaryDirectory() as directory:
+        store = TelemetryStore(os.path.join(directory, 'telemetry.db'), write_interval=3600)
+        store.open()
+        statuses = [({'coordinates': [i % 100, i % 50], 'speed': 42.0, 'is_in_service_zone': True}, f'car-{i}')
+                    for i in range(CARS)]
+
+        start = time.perf_counter()
+        for tick in range(TICKS):
+            for status, brand in statuses:
+                store.append(brand, status, ts=tick)
+        ingest = time.perf_counter() - start
+
+        start = time.perf_counter()
+        written = store.flush()
+        write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        track = store.track('car-42', 0, TICKS)
+        query = time.perf_counter() - start
+
+    samples = CARS * TICKS
+    print(f'Приём: {samples} точек за {ingest:.3f} с ({samples / ingest:,.0f} точек/с)')
+    print(f'Запись: {written} точек за {write:.3f} с ({written / write:,.0f} точек/с)')
+    print(f'Трек одного автомобиля: {len(track)} точек за {query * 1000:.2f} мс')
+
+
+if __name__ == '__main__':
+    bench_telemetry_store()
@@ -0,0 +1,28 @@
+import requests
+import time
+
+
+PAYMENT_URL = 'http://0.0.0.0:8000'
+
+
+def paid_invoice(client_id, amount):
+    invoice = requests.post(f'{PAYMENT_URL}/invoices', json={'client_id': client_id, 'amount': amount}).json()
+    requests.post(f'{PAYMENT_URL}/invoices/{invoice["id"]}/confirm')
+    return invoice
+
+
+# Новый счёт после архивации не получает id счёта из архива, чеки по id не путаются
+def test_invoice_ids_after_archive():
+    client = requests.post(f'{PAYMENT_URL}/clients', json={'name': f'Архив Счетов {time.time()}'}).json()[0]
+    archived = paid_invoice(client['id'], 100)
+    requests.post(f'{PAYMENT_URL}/archive/run', params={'min_age': 0})
+
+    created = paid_invoice(client['id'], 200)
+    assert created['id'] > archived['id']
+    requests.post(f'{PAYMENT_URL}/archive/run', params={'min_age': 0})
+
+    for invoice in (archived, created):
+        response = requests.get(f'{PAYMENT_URL}/invoices/{invoice["id"]}/receipt')
+        assert response.status_code == 200
+        assert response.json()['receipt']['amount'] == invoice['amount']
+        assert response.json()['receipt']['client_id'] == client['id']
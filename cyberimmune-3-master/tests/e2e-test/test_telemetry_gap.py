@@ -0,0 +1,42 @@
+import requests
+import time
+
+
+PAYMENT_URL = 'http://0.0.0.0:8000'
+MANAGMENT_URL = 'http://0.0.0.0:8003'
+BRAND = 'Honda'
+
+
+# Пакет телеметрии посреди поездки потерян: нарушения в чеке не меньше итогов, переданных автомобилем
+def test_lost_telemetry_batch():
+    name = f'Пропуск Телеметрии {time.time()}'
+    tariff = requests.get(f'{MANAGMENT_URL}/tariff').json()[0]
+    prepayment = requests.post(f'{MANAGMENT_URL}/select/car/{BRAND}',
+                               json={'client_name': name, 'experience': 1, 'tariff': tariff})
+    requests.post(f'{PAYMENT_URL}/prepayment/{prepayment.json()["id"]}/confirm')
+
+    ts = time.time()
+    start = {'brand': BRAND, 'kind': 'key', 'seq': 1, 'ts': ts, 'speed': 10, 'coordinates': [0, 0],
+             'is_in_service_zone': True, 'trip_time': 0, 'speed_violations': 0, 'zone_violations': 0}
+    speeding = {'brand': BRAND, 'kind': 'delta', 'seq': 2, 'ts': ts + 1, 'speed': 80, 'speed_violations': 1}
+    requests.post(f'{MANAGMENT_URL}/telemetry/batch', json={'statuses': [start, speeding]})
+    # Пакет с сообщениями 3-5 не дошёл, следующее сообщение приходит с пропуском номера
+    response = requests.post(f'{MANAGMENT_URL}/telemetry/batch', json={'statuses': [
+        {'brand': BRAND, 'kind': 'delta', 'seq': 6, 'ts': ts + 4, 'speed': 10, 'speed_violations': 3}]})
+    assert BRAND in response.json()['resync']
+
+    status = {'trip_time': 5, 'speed_violations': 3, 'zone_violations': 2}
+    invoice = requests.post(f'{MANAGMENT_URL}/return/{name}', json={'status': status, 'ts': ts + 5, 'seq': 6})
+    assert invoice.status_code == 200
+    invoice_id = invoice.json()['id']
+    requests.post(f'{PAYMENT_URL}/invoices/{invoice_id}/confirm')
+
+    # Подтверждение оплаты доходит до системы управления через очередь сообщений
+    for _ in range(20):
+        receipt = requests.get(f'{MANAGMENT_URL}/receipts/{invoice_id}')
+        if receipt.status_code == 200:
+            break
+        time.sleep(0.5)
+    assert receipt.status_code == 200
+    assert receipt.json()['speed_violations'] == 3
+    assert receipt.json()['zone_violations'] == 2